@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+
+import os, sys, re, json, glob, time, zlib, random, getopt, shutil, runpy, tempfile, subprocess
+from terminaltables import AsciiTable
+
+# End to end benchmark of main.py without touching Warcraft Logs. Every request
+# goes to a fake transport plugged into the shared api client, which answers
+# from either:
+#
+#   - a synthetic scenario: reports generated on the fly, the same every run
+#       shazzrah  all schools on Shazzrah, with Deaden Magic up a third of the fight
+#       scorch    fire on Ragnaros, mages keeping Improved Scorch stacked all fight
+#   - a recorded fixture (-R to record, -f to replay): every response of a real
+#     scrape stored in a ResponseCache file, plus the zone summaries it used
+#
+# Each scenario runs main.py in a fresh process and scratch directory and reports
+# reports/s, damage events/s, requests and peak memory. Synthetic scenarios run
+# in every response cache mode (-C):
+#
+#   none  with -x, every report loaded with its own request
+#   fill  an empty response cache, so reports are prefetched in batches
+#   warm  a second run over the cache the first one filled (the first isn't timed)
+#
+# Results can be saved (-w) and compared against a saved run (-b) to catch
+# regressions.
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# spec icon -> (spec name, spell ids, curse id, crit multiplier, [(damage modifier id,
+# modifier per stack)]) of the players in synthetic reports, as main.py sets up each spec
+syntheticSpecs = {
+    'Mage': ('Fire', [10151, 10207, 10199], 11722, 1.5, [(22959, 0.03), (23605, 0.15)]),
+    'Mage-Frost': ('Frost', [25304, 10181], 11722, 1.5, []),
+    'Warlock-Destruction': ('Destruction', [25307, 11661], 17937, 1.5, []),
+    'Druid-Balance': ('Balance', [25298, 9876, 9835], 17937, 2.0, []),
+    'Shaman-Elemental': ('Elemental', [15208], None, 2.0, []),
+}
+CURSE_MODIFIER = 1.1  # damage taken with a curse up
+
+syntheticScenarios = {
+    'shazzrah': {
+        'zoneID': 1000,
+        'enemyID': 12264,
+        'args': ['-e', '12264'],
+        'players': {'Mage': 5, 'Mage-Frost': 2, 'Warlock-Destruction': 5, 'Druid-Balance': 3, 'Shaman-Elemental': 3},
+        'fightLength': 120000,
+        'castTime': 2500,
+        'deadenMagic': True,
+        'scorchCycles': 1,
+    },
+    'scorch': {
+        'zoneID': 1000,
+        'enemyID': 11502,
+        'args': ['-m', 'fire', '-e', '11502'],
+        'players': {'Mage': 12, 'Warlock-Destruction': 4, 'Druid-Balance': 2, 'Shaman-Elemental': 2},
+        'fightLength': 360000,
+        'castTime': 1500,
+        'deadenMagic': False,
+        'scorchCycles': 20,
+    },
+}
+
+SYNTHETIC_PAGE_SIZE = 300  # events per page, like the real api's pagination
+ENEMY_ACTOR_ID = 100
+spellHitItems = [11662, 12103]
+spellPenItems = [16444]
+
+
+class FakeResponse:
+    def __init__(self, data, status_code: int = 200):
+        self.status_code = status_code
+        self.reason = 'OK' if status_code == 200 else 'Not Found'
+        self.headers = {}
+        self.content = json.dumps(data).encode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        pass
+
+# the rate limit is never a concern offline
+rateLimitData = {'data': {'rateLimitData': {'limitPerHour': 0, 'pointsSpentThisHour': 0, 'pointsResetIn': 0}}}
+
+# stand-in for requests.Session, counting what's asked of it
+class FakeTransport:
+    def __init__(self):
+        self.requests = 0
+
+    def request(self, method: str, url: str, **kwargs):
+        self.requests += 1
+        if method == 'POST':
+            query = kwargs.get('json').get('query')
+            if 'rateLimitData' in query:
+                return FakeResponse(rateLimitData)
+            return self.graphql(url, query)
+        return FakeResponse({'error': 'not supported'}, 404)
+
+    # the key utils uses to cache the same request
+    @staticmethod
+    def getKey(method: str, url: str, kwargs: dict) -> str:
+        from responsecache import ResponseCache
+        return ResponseCache.getKey(url, kwargs.get('json').get('query'))
+
+
+# replays a recorded fixture. requests that weren't recorded fail like the api would
+class ReplayTransport(FakeTransport):
+    def __init__(self, fixtures):
+        super().__init__()
+        self.fixtures = fixtures
+        self.missing = 0
+
+    def request(self, method: str, url: str, **kwargs):
+        self.requests += 1
+        if method == 'POST' and 'rateLimitData' in kwargs.get('json').get('query'):
+            return FakeResponse(rateLimitData)
+        response = self.fixtures.get(self.getKey(method, url, kwargs))
+        if response == None:
+            self.missing += 1
+            return FakeResponse({'errors': [{'message': 'not recorded'}]})
+        return FakeResponse(response)
+
+
+# passes requests on to the real api and records the responses
+class RecordingTransport(FakeTransport):
+    def __init__(self, session, fixtures):
+        super().__init__()
+        self.session = session
+        self.fixtures = fixtures
+
+    def request(self, method: str, url: str, **kwargs):
+        self.requests += 1
+        response = self.session.request(method, url, **kwargs)
+        if response.status_code == 200:
+            try:
+                self.fixtures.put(self.getKey(method, url, kwargs), response.json())
+            except ValueError:
+                pass
+        return response
+
+
+# Generates reports for a synthetic scenario from the report code, so every run
+# sees exactly the same data.
+class SyntheticTransport(FakeTransport):
+    def __init__(self, scenario: dict):
+        super().__init__()
+        self.scenario = scenario
+        self.reports = {}
+
+    def getRandom(self, reportCode: str, salt: str = ''):
+        return random.Random(zlib.crc32((reportCode + salt).encode('utf-8')))
+
+    def getActors(self, reportCode: str) -> list:
+        actors = []
+        for icon, count in self.scenario.get('players').items():
+            for i in range(count):
+                actors.append({'id': len(actors) + 1, 'name': icon + str(i), 'type': 'Player',
+                               'subType': icon.split('-')[0], 'icon': icon, 'gameID': 0})
+        actors.append({'id': ENEMY_ACTOR_ID, 'name': 'Boss', 'type': 'NPC', 'subType': 'Boss',
+                       'icon': 'Boss', 'gameID': self.scenario.get('enemyID')})
+        return actors
+
+    # every player's gear, or only the gear of players of `specName`
+    def getGear(self, reportCode: str, specName: str = None) -> list:
+        r = self.getRandom(reportCode, 'gear')
+        events = []
+        for actor in self.getActors(reportCode):
+            if actor.get('type') != 'Player':
+                continue
+            gear = [{'id': r.choice(spellHitItems)} for i in range(r.randint(0, 3))]
+            if r.random() < 0.1:
+                gear.append({'id': r.choice(spellPenItems)})
+            if specName != None and syntheticSpecs.get(actor.get('icon'), (None,))[0] != specName:
+                continue
+            events.append({'timestamp': 0, 'type': 'combatantinfo', 'sourceID': actor.get('id'), 'gear': gear})
+        return events
+
+    # the curse and the damage modifier up on the boss over the fight for players with `icon`,
+    # read from the aura events the same way main.py does: [(startTime, endTime, multiplier)]
+    # each, inclusive. where damage modifiers overlap the first one listed wins
+    def getMultiplierBands(self, reportCode: str, icon: str) -> list:
+        specName, spellIDs, curseID, critMultiplier, dmgMods = syntheticSpecs[icon]
+        curseBands = []
+        if curseID != None:
+            startTime = 0
+            for event in self.getAuraEvents(reportCode, curseID):
+                if event.get('type') == 'applydebuff':
+                    startTime = event.get('timestamp')
+                else:
+                    curseBands.append((startTime, event.get('timestamp'), CURSE_MODIFIER))
+
+        modifierBands = []
+        for abilityID, modifier in dmgMods:
+            startTime, stacks = 0, 0
+            for event in self.getAuraEvents(reportCode, abilityID):
+                if event.get('type') == 'applydebuff':
+                    startTime, stacks = event.get('timestamp') + 1, 1
+                    continue
+                modifierBands.append((startTime, event.get('timestamp'), 1 + stacks * modifier))
+                if event.get('type') == 'applydebuffstack':
+                    startTime, stacks = event.get('timestamp') + 1, stacks + 1
+                else:
+                    stacks = 0
+        return [curseBands, modifierBands]
+
+    # every player of `specName` casting its spells at the boss for the whole fight. damage
+    # is raised by the curse and damage modifier up at the time, so main.py finds the partial
+    # it was generated as
+    def getDamage(self, reportCode: str, specName: str) -> list:
+        r = self.getRandom(reportCode, specName)
+        events = []
+        for actor in self.getActors(reportCode):
+            icon = actor.get('icon')
+            if icon not in syntheticSpecs or syntheticSpecs[icon][0] != specName:
+                continue
+            spellIDs, critMultiplier = syntheticSpecs[icon][1], syntheticSpecs[icon][3]
+            multiplierBands = self.getMultiplierBands(reportCode, icon)
+            timestamp = r.randint(1000, 5000)
+            while timestamp < self.scenario.get('fightLength'):
+                unmitigated = r.randint(1500, 3000)
+                hitType = r.choice([1, 1, 1, 2, 14, 16, 16, 17])
+                multiplier = {1: 1, 2: critMultiplier, 14: 0, 16: 1, 17: critMultiplier}[hitType]
+                if hitType in (16, 17):
+                    multiplier *= r.choice([0.75, 0.5, 0.25])
+                for bands in multiplierBands:
+                    multiplier *= next((mod for startTime, endTime, mod in bands if startTime <= timestamp <= endTime), 1)
+                events.append({'timestamp': timestamp, 'type': 'damage', 'sourceID': actor.get('id'), 'targetID': ENEMY_ACTOR_ID,
+                               'abilityGameID': r.choice(spellIDs), 'hitType': hitType, 'amount': int(unmitigated * multiplier),
+                               'unmitigatedAmount': unmitigated, 'tick': r.random() < 0.05})
+                timestamp += r.randint(self.scenario.get('castTime'), self.scenario.get('castTime') * 2)
+        events.sort(key=lambda event: event.get('timestamp'))
+        return events
+
+    # `count` bands of `length` ms spread over the fight
+    def getBands(self, reportCode: str, salt: str, count: int, length: int) -> list:
+        r = self.getRandom(reportCode, salt)
+        fightLength = self.scenario.get('fightLength')
+        bands = []
+        for i in range(count):
+            startTime = i * fightLength // count + r.randint(0, 2000)
+            bands.append({'startTime': startTime, 'endTime': startTime + length})
+        return bands
+
+    # improved scorch stacking to 5 and falling off, `scorchCycles` times a fight
+    def getDebuffEvents(self, reportCode: str, abilityID: int) -> list:
+        r = self.getRandom(reportCode, str(abilityID))
+        cycles = self.scenario.get('scorchCycles') if abilityID == 22959 else 2
+        events = []
+        for band in self.getBands(reportCode, str(abilityID), cycles, self.scenario.get('fightLength') // cycles - 3000):
+            timestamp = band.get('startTime')
+            events.append({'timestamp': timestamp, 'type': 'applydebuff', 'targetID': ENEMY_ACTOR_ID})
+            for stack in range(4 if abilityID == 22959 else 0):
+                timestamp += r.randint(1500, 3000)
+                events.append({'timestamp': timestamp, 'type': 'applydebuffstack', 'targetID': ENEMY_ACTOR_ID})
+            events.append({'timestamp': band.get('endTime'), 'type': 'removedebuff', 'targetID': ENEMY_ACTOR_ID})
+        return events
+
+    # buff or debuff events of `abilityID` on the boss
+    def getAuraEvents(self, reportCode: str, abilityID: int) -> list:
+        if abilityID in (22959, 23605):  # improved scorch, nightfall
+            return self.getDebuffEvents(reportCode, abilityID)
+        if abilityID == 19714:  # deaden magic, up for 10s every 30s
+            auraType = 'buff'
+            bands = self.getBands(reportCode, 'deaden', self.scenario.get('fightLength') // 30000, 10000) if self.scenario.get('deadenMagic') else []
+        else:  # curses, up most of the fight
+            auraType = 'debuff'
+            bands = self.getBands(reportCode, str(abilityID), 4, self.scenario.get('fightLength') // 5)
+        events = []
+        for band in bands:
+            events.append({'timestamp': band.get('startTime'), 'type': 'apply' + auraType, 'targetID': ENEMY_ACTOR_ID, 'abilityGameID': abilityID})
+            events.append({'timestamp': band.get('endTime'), 'type': 'remove' + auraType, 'targetID': ENEMY_ACTOR_ID, 'abilityGameID': abilityID})
+        return events
+
+    def getEventsPage(self, reportCode: str, dataType: str, startTime: int, filterExpression: str, abilityID: int) -> dict:
+        key = (reportCode, dataType, filterExpression, abilityID)
+        if key not in self.reports:
+            if dataType == 'CombatantInfo':
+                specName = re.search(r"source\.spec='(\w+)'", filterExpression)
+                self.reports[key] = self.getGear(reportCode, specName.group(1) if specName else None)
+            elif dataType in ('Buffs', 'Debuffs'):
+                self.reports[key] = self.getAuraEvents(reportCode, abilityID)
+            else:
+                specName = re.search(r"source\.spec='(\w+)'", filterExpression)
+                self.reports[key] = self.getDamage(reportCode, specName.group(1) if specName else '')
+            # the actor filters main.py pushes to the server
+            for actor in ('source', 'target'):
+                actorIDs = re.search(actor + r'\.id in \(([\d, ]+)\)', filterExpression)
+                if actorIDs != None:
+                    actorIDs = set(int(actorID) for actorID in actorIDs.group(1).split(','))
+                    self.reports[key] = [event for event in self.reports[key] if event.get(actor + 'ID') in actorIDs]
+        events = [event for event in self.reports[key] if event.get('timestamp') >= startTime]
+        page = events[:SYNTHETIC_PAGE_SIZE]
+        nextPageTimestamp = events[SYNTHETIC_PAGE_SIZE].get('timestamp') if len(events) > SYNTHETIC_PAGE_SIZE else None
+        return {'data': page, 'nextPageTimestamp': nextPageTimestamp}
+
+    # answers every (aliased) events field of a report's `fields`, plus masterData
+    def getReport(self, reportCode: str, fields: str) -> dict:
+        report = {}
+        if 'masterData' in fields:
+            report['masterData'] = {'actors': self.getActors(reportCode)}
+        for events in re.finditer(r'(?:(\w+): )?events\((.*?)\)\s*\{', fields, re.DOTALL):
+            arguments = events.group(2)
+            dataType = re.search(r'dataType: (\w+)', arguments).group(1)
+            startTime = int(re.search(r'startTime: (\d+)', arguments).group(1))
+            abilityID = re.search(r'abilityID: (\d+)', arguments)
+            filterExpression = re.search(r'filterExpression: "(.*)"', arguments)
+            report[events.group(1) or 'events'] = self.getEventsPage(reportCode, dataType, startTime,
+                filterExpression.group(1) if filterExpression else '', int(abilityID.group(1)) if abilityID else None)
+        return report
+
+    # a report query, or a batch of aliased ones (r0: report(...), r1: report(...), ...)
+    def graphql(self, url: str, query: str):
+        reports = list(re.finditer(r'(?:(\w+): )?report\(code: "(\w+)"\)', query))
+        if len(reports) == 0:
+            return FakeResponse({'errors': [{'message': 'not supported by the synthetic transport'}]})
+
+        reportData = {}
+        for i, report in enumerate(reports):
+            fields = query[report.end():reports[i + 1].start() if i + 1 < len(reports) else len(query)]
+            reportData[report.group(1) or 'report'] = self.getReport(report.group(2), fields)
+        return FakeResponse({'data': {'reportData': reportData}})
+
+
+# a scratch directory with what main.py reads
+def makeScratchDirectory(scratch: str):
+    for name in ('zone.json', 'item.json'):
+        shutil.copy(os.path.join(BENCHMARK_DIR, name), scratch)
+    os.makedirs(os.path.join(scratch, 'cache'))
+
+# run main.py with `args` in the current directory, every request going to `transport`
+def runMain(transport, args: list):
+    sys.path.insert(0, BENCHMARK_DIR)
+    import utils
+    utils.client.session = transport
+    sys.argv = ['main.py'] + args
+    return runpy.run_path(os.path.join(BENCHMARK_DIR, 'main.py'), run_name='__main__')
+
+CACHE_MODES = ('none', 'fill', 'warm')
+
+# run one scenario in this process and return its numbers. `cacheMode` is one of
+# CACHE_MODES, fixtures are always run without the response cache
+def runScenario(name: str, reportCount: int, workers: int, fixtureDir: str = None, traceMemory: bool = False, cacheMode: str = 'none') -> dict:
+    import resource, tracemalloc, contextlib
+    import utils
+    from summaries import ReportSummaryStore
+    from responsecache import ResponseCache
+    from profiler import profiler
+
+    with tempfile.TemporaryDirectory() as scratch:
+        makeScratchDirectory(scratch)
+        os.chdir(scratch)
+        if fixtureDir != None:
+            with open(os.path.join(fixtureDir, 'args.json')) as f:
+                scenarioArgs = json.load(f)
+            for summaries in glob.glob(os.path.join(fixtureDir, '*.summaries')):
+                shutil.copy(summaries, 'cache')
+            transport = ReplayTransport(ResponseCache(os.path.join(fixtureDir, 'responses.sqlite')))
+        else:
+            scenario = syntheticScenarios[name]
+            scenarioArgs = scenario.get('args') + ['-s', '1000000000']
+            icons = list(scenario.get('players'))
+            spellIDs = sorted(set(spellID for icon in icons for spellID in syntheticSpecs[icon][1]))
+            ReportSummaryStore.write('cache/' + str(scenario.get('zoneID')) + '.summaries',
+                [{'code': 'B{:06d}'.format(i), 'spellIDs': spellIDs, 'icons': icons} for i in range(reportCount)])
+            transport = SyntheticTransport(scenario)
+
+        mainArgs = ['-f', '-q', '-j', str(workers)] + scenarioArgs
+        if cacheMode == 'warm':
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                runMain(transport, mainArgs)
+            utils.responseCache.close()
+            transport = SyntheticTransport(scenario)
+        if cacheMode == 'none':
+            mainArgs = ['-x'] + mainArgs
+
+        profiler.enable()
+        if traceMemory:
+            tracemalloc.start()
+        startedAt = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            state = runMain(transport, mainArgs)
+        seconds = time.perf_counter() - startedAt
+
+        maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result = {
+            'scenario': name + (' (cache ' + cacheMode + ')' if cacheMode != 'none' else ''),
+            'reports': sum(scrape.reportsDone for scrape in state.get('scrapes', [])),
+            'events': profiler.counters.get('damage events classified', 0),
+            'requests': transport.requests,
+            'seconds': round(seconds, 3),
+            'peakRSS': round(maxRSS / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),  # MB
+            'peakTraced': round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1) if traceMemory else None,
+        }
+        if fixtureDir != None:
+            result['missing'] = transport.missing
+        os.chdir(BENCHMARK_DIR)
+    return result
+
+# scrape the live api with `args`, saving every response and the summaries used to `fixtureDir`
+def recordFixture(fixtureDir: str, args: list):
+    from responsecache import ResponseCache
+    os.makedirs(fixtureDir, exist_ok=True)
+    fixtureDir = os.path.abspath(fixtureDir)
+    with tempfile.TemporaryDirectory() as scratch:
+        makeScratchDirectory(scratch)
+        for pattern in ('*.summaries', '*.json.gz', '*.jsonl.gz', '*.cursor.json'):
+            for FilePath in glob.glob(os.path.join(BENCHMARK_DIR, 'cache', pattern)):
+                shutil.copy2(FilePath, os.path.join(scratch, 'cache'))
+        os.chdir(scratch)
+
+        import utils
+        fixtures = ResponseCache(os.path.join(fixtureDir, 'responses.sqlite'))
+        transport = RecordingTransport(utils.client.session, fixtures)
+        runMain(transport, ['-x', '-f'] + args)
+        fixtures.close()
+        for summaries in glob.glob('cache/*.summaries'):
+            shutil.copy(summaries, fixtureDir)
+        os.chdir(BENCHMARK_DIR)
+
+    with open(os.path.join(fixtureDir, 'args.json'), 'w') as f:
+        json.dump(args, f)
+    print('recorded ' + str(transport.requests) + ' requests to ' + fixtureDir)
+
+def printUsage():
+    print(
+        '''
+Usage: benchmark.py [OPTIONS] | -R <fixtureDir> -- <main.py arguments>
+
+-h                      Show usage and exit (this screen)
+-n  <reports>           Reports per synthetic scenario (DEFAULT: 200)
+-j  <workers>           Workers passed to main.py (DEFAULT: 1)
+-r  <rounds>            Run each scenario <rounds> times and keep the fastest (DEFAULT: 1)
+-S  <scenarios>         Synthetic scenarios delimited by comma (DEFAULT: shazzrah,scorch)
+-C  <modes>             Response cache modes to run synthetic scenarios in, delimited by comma: none (-x), fill, warm (DEFAULT: none,fill,warm)
+-f  <fixtureDir>        Replay a recorded fixture instead, can be repeated
+-m                      Also measure peak python memory with tracemalloc (slower) (DEFAULT: False)
+-w  <results.json>      Write the results to <results.json>
+-b  <results.json>      Compare against results written with -w
+-R  <fixtureDir>        Record a fixture: run main.py against the live api with the given arguments
+
+EXAMPLE
+ Record Shazzrah and compare a change against it:
+   `benchmark.py -R bench/shazzrah -- -e 12264 -s 300`
+   `benchmark.py -f bench/shazzrah -w before.json`, change things, `benchmark.py -f bench/shazzrah -b before.json`
+        '''
+    )
+
+def displayBenchmarkResults(results: list, baseline: list):
+    baseline = {result.get('scenario'): result for result in baseline}
+    table_data = [('scenario', 'reports', 'events', 'requests', 's', 'reports/s', 'events/s', 'peak RSS MB', 'peak traced MB', 'vs baseline')]
+    for result in results:
+        reportsPerSecond = result.get('reports') / max(result.get('seconds'), 1e-9)
+        change = ''
+        if result.get('scenario') in baseline:
+            before = baseline[result.get('scenario')]
+            beforePerSecond = before.get('reports') / max(before.get('seconds'), 1e-9)
+            change = '{:+.1f}%'.format(100 * (reportsPerSecond / beforePerSecond - 1)) if beforePerSecond > 0 else '?'
+        table_data.append((result.get('scenario'), result.get('reports'), result.get('events'), result.get('requests'), result.get('seconds'),
+                           round(reportsPerSecond, 1), round(result.get('events') / max(result.get('seconds'), 1e-9)),
+                           result.get('peakRSS'), result.get('peakTraced') if result.get('peakTraced') != None else '-', change))
+    print(AsciiTable(table_data, 'Benchmark').table)
+    for result in results:
+        if result.get('missing'):
+            print('WARNING: ' + result.get('scenario') + ' asked for ' + str(result.get('missing')) + ' requests that weren\'t recorded')
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hn:j:r:S:C:f:mw:b:R:c')
+    except getopt.GetoptError:
+        printUsage()
+        sys.exit(2)
+
+    reportCount = 200
+    workers = 1
+    rounds = 1
+    scenarioNames = list(syntheticScenarios)
+    cacheModes = list(CACHE_MODES)
+    fixtureDirs = []
+    traceMemory = False
+    resultsFile = None
+    baselineFile = None
+    child = False
+    for opt, arg in opts:
+        if opt == '-h':
+            printUsage()
+            sys.exit(0)
+        elif opt == '-n':
+            reportCount = int(arg)
+        elif opt == '-j':
+            workers = max(int(arg), 1)
+        elif opt == '-r':
+            rounds = max(int(arg), 1)
+        elif opt == '-S':
+            scenarioNames = [x.strip() for x in arg.split(',')]
+        elif opt == '-C':
+            cacheModes = [x.strip() for x in arg.split(',')]
+        elif opt == '-f':
+            fixtureDirs.append(arg)
+        elif opt == '-m':
+            traceMemory = True
+        elif opt == '-w':
+            resultsFile = arg
+        elif opt == '-b':
+            baselineFile = arg
+        elif opt == '-R':
+            recordFixture(arg, args)
+            sys.exit(0)
+        elif opt == '-c':
+            child = True
+
+    # a single scenario in this process (how the parent runs each one)
+    if child:
+        fixtureDir = fixtureDirs[0] if len(fixtureDirs) > 0 else None
+        name = os.path.basename(os.path.normpath(fixtureDir)) if fixtureDir != None else scenarioNames[0]
+        cacheMode = cacheModes[0] if fixtureDir == None else 'none'
+        print(json.dumps(runScenario(name, reportCount, workers, os.path.abspath(fixtureDir) if fixtureDir else None, traceMemory, cacheMode)))
+        sys.exit(0)
+
+    for name in scenarioNames:
+        if name not in syntheticScenarios:
+            print('ERROR: Invalid scenario: ' + name)
+            printUsage()
+            sys.exit(4)
+    for cacheMode in cacheModes:
+        if cacheMode not in CACHE_MODES:
+            print('ERROR: Invalid cache mode: ' + cacheMode)
+            printUsage()
+            sys.exit(4)
+
+    runs = [['-f', fixtureDir] for fixtureDir in fixtureDirs] if len(fixtureDirs) > 0 else \
+           [['-S', name, '-C', cacheMode] for name in scenarioNames for cacheMode in cacheModes]
+    results = []
+    for run in runs:
+        best = None
+        for i in range(rounds):
+            command = [sys.executable, os.path.abspath(__file__), '-c', '-n', str(reportCount), '-j', str(workers)] + run + (['-m'] if traceMemory else [])
+            process = subprocess.run(command, capture_output=True, text=True)
+            if process.returncode != 0:
+                print(process.stdout + process.stderr)
+                print('ERROR: ' + ' '.join(run) + ' failed')
+                sys.exit(1)
+            result = json.loads(process.stdout.strip().split('\n')[-1])
+            print('{} round {}: {}s'.format(result.get('scenario'), i + 1, result.get('seconds')))
+            if best == None or result.get('seconds') < best.get('seconds'):
+                best = result
+        results.append(best)
+
+    baseline = []
+    if baselineFile != None:
+        with open(baselineFile) as f:
+            baseline = json.load(f)
+    displayBenchmarkResults(results, baseline)
+
+    if resultsFile != None:
+        with open(resultsFile, 'w') as f:
+            json.dump(results, f, indent=2)
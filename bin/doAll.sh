@@ -5,7 +5,6 @@
 # - buru's trash mobs
 ignoreEnemies="15379,15514,15521"
 
-for zone in 1000 1001 1002 1003 1004 1005; do
-  # -q quiet mode, -c skip curses, -w write results
-  nohup python -u ./main.py -qcw -z $zone -i $ignoreEnemies > logs/$zone.log 2>&1 &
-done
+# one process scrapes every zone, sharing the api budget between them
+# -q quiet mode, -b count casts with and without curses, -w write results, -j workers
+nohup python -u ./main.py -qbw -j 8 -z 1000,1001,1002,1003,1004,1005 -i $ignoreEnemies > logs/all.log 2>&1 &
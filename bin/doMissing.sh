@@ -17,6 +17,5 @@ missing4="14509 15084"
 # round 5 (final)
 missing5="11583 11981 15084 15085"
 
-for enemyid in $missing5; do
-  nohup python -u ./main.py -m arcane,fire,nature,shadow -cw -e $enemyid > logs/$enemyid.log 2>&1 &
-done
+# one process for all of them, enemies that broke resume from their checkpoint
+nohup python -u ./main.py -m arcane,fire,nature,shadow -cw -j 8 -e ${missing5// /,} > logs/missing.log 2>&1 &
@@ -1,22 +1,10 @@
 #!/usr/bin/env bash
 
+# a log can hold several encounters (main.py -z 1000,1001 ...), so show the last
+# line of each encounter
 for file in logs/*; do
-  #echo "file: $file"
-  #echo "out: $out"
-  out="$(tail -n 1 $file)"
-  if echo $out | grep -vq "Processing report"; then
-    echo "$(basename $file): Needs looking at ($out)"
-    continue
-  fi
-
-  curr="$(echo $out | cut -d\- -f 2 | cut -d' ' -f 4)"
-  total="$(echo $out | cut -d\- -f 2 | cut -d' ' -f 6)"
-
-  if [ "$curr" != "$total" ]; then
-    echo "$(basename $file): Still working ($curr of $total)"
-    continue
-  fi
-
-  #echo "curr: $curr"
-  #echo "total: $total"
+  grep -o '^\[[^]]*\] - \(Processing report [0-9]* of [0-9]*\|Done.*\)' "$file" | \
+    awk -F' - ' -v file="$(basename $file)" '
+      { if (!($1 in last)) order[n++] = $1; last[$1] = $2 }
+      END { for (i = 0; i < n; i++) print file ": " order[i] " " last[order[i]] }'
 done
@@ -0,0 +1,148 @@
+import random, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+from datetime import datetime
+from profiler import profiler
+
+# responses worth retrying: rate limited or the server having a bad time
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Keeps track of the v2 api's hourly points budget (`rateLimitData`). Every
+# `refreshInterval` seconds the current usage is re-read. In between, every
+# request counts an estimated cost locally, re-estimated at each refresh from
+# how far the real usage moved per request, so many workers can't overshoot the
+# budget before the next refresh. Once we're within `reserve` of the limit every
+# request waits until the budget resets instead of getting throttled.
+class PointsBudget:
+    def __init__(self, refreshInterval: float = 60, reserve: float = 0.02, estimatedCost: float = 1):
+        self.refreshInterval = refreshInterval
+        self.reserve = reserve
+        self.lock = threading.Lock()
+        self.refresh = None  # callable returning {limitPerHour, pointsSpentThisHour, pointsResetIn}
+        self.refreshedAt = 0
+        self.limitPerHour = None
+        self.pointsSpent = 0  # as of the last refresh plus the estimated cost of every request since
+        self.refreshedPointsSpent = 0
+        self.requestsSinceRefresh = 0
+        self.estimatedCost = estimatedCost  # points per request
+        self.resetAt = 0
+
+    def update(self, rateLimitData: dict):
+        pointsSpent = rateLimitData.get('pointsSpentThisHour', 0)
+        # other scrapers sharing the key make this overestimate, which errs on the safe side
+        if self.requestsSinceRefresh > 0 and pointsSpent >= self.refreshedPointsSpent:
+            self.estimatedCost = max((pointsSpent - self.refreshedPointsSpent) / self.requestsSinceRefresh, 1)
+        self.limitPerHour = rateLimitData.get('limitPerHour')
+        self.pointsSpent = pointsSpent
+        self.refreshedPointsSpent = pointsSpent
+        self.requestsSinceRefresh = 0
+        self.resetAt = time.time() + rateLimitData.get('pointsResetIn', 0)
+        self.refreshedAt = time.time()
+
+    def isExhausted(self) -> bool:
+        if not self.limitPerHour:
+            return False
+        return self.pointsSpent >= self.limitPerHour * (1 - self.reserve) and time.time() < self.resetAt
+
+    # once our own count has used up half of what was left at the last refresh,
+    # re-read the budget early to check the estimate before it can overshoot
+    def isEstimateDue(self) -> bool:
+        if not self.limitPerHour or self.requestsSinceRefresh == 0 or time.time() >= self.resetAt:
+            return False
+        left = self.limitPerHour * (1 - self.reserve) - self.refreshedPointsSpent
+        return self.pointsSpent - self.refreshedPointsSpent >= left / 2
+
+    # block until there's budget left, then count the request against it. only
+    # one thread refreshes at a time, the rest wait on the lock and reuse what it
+    # found. waiting for a reset happens outside the lock.
+    def wait(self):
+        if self.refresh == None:
+            return
+        while True:
+            with self.lock:
+                if time.time() - self.refreshedAt >= self.refreshInterval or self.isEstimateDue():
+                    try:
+                        self.update(self.refresh())
+                    except Exception as e:
+                        print('Failed to refresh rate limit: ' + str(e))
+                        # keep counting from here instead of retrying on every request
+                        self.refreshedAt = time.time()
+                        self.refreshedPointsSpent = self.pointsSpent
+                        self.requestsSinceRefresh = 0
+
+                if not self.isExhausted():
+                    self.pointsSpent += self.estimatedCost
+                    self.requestsSinceRefresh += 1
+                    return
+
+                delay = self.resetAt - time.time() + 1
+                # re-read the budget as soon as it has reset
+                self.refreshedAt = min(self.refreshedAt, self.resetAt + 1 - self.refreshInterval)
+                print('Points budget spent ({} of {}), sleeping {}s'.format(round(self.pointsSpent), self.limitPerHour, round(delay)), datetime.now())
+            time.sleep(delay)
+
+
+# One keep-alive connection pool shared by every thread for the v2 (graphql)
+# api. Failed requests (network errors, 429 and 5xx) are retried with jittered
+# exponential backoff, honoring `Retry-After` when the server sends it.
+class APIClient:
+    def __init__(self, poolSize: int = 64, timeout: float = 60, maxRetries: int = 10,
+                 backoffBase: float = 2, backoffMax: float = 300):
+        self.timeout = timeout
+        self.maxRetries = maxRetries
+        self.backoffBase = backoffBase
+        self.backoffMax = backoffMax
+        self.budget = PointsBudget()
+        self.requestCount = 0  # http requests sent, retries included
+        self.countLock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=poolSize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def getBackoff(self, attempt: int) -> float:
+        return random.uniform(0.5, 1) * min(self.backoffMax, self.backoffBase * 2 ** attempt)
+
+    def getRetryAfter(self, response) -> float:
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+    # `endpoint` names the request in profiler output, it defaults to the url
+    def request(self, method: str, url: str, useBudget: bool = True, endpoint: str = None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = endpoint or url
+        for attempt in range(self.maxRetries + 1):
+            if useBudget:
+                with profiler.timer('points budget wait'):
+                    self.budget.wait()
+
+            with self.countLock:
+                self.requestCount += 1
+            try:
+                with profiler.timer('http ' + endpoint):
+                    response = self.session.request(method, url, **kwargs)
+                    profiler.count('bytes ' + endpoint, len(response.content))
+            except requests.RequestException as e:
+                error = e
+                delay = self.getBackoff(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                error = requests.HTTPError('{} {}'.format(response.status_code, response.reason), response=response)
+                delay = self.getRetryAfter(response) or self.getBackoff(attempt)
+                response.close()
+
+            if attempt == self.maxRetries:
+                break
+            profiler.count('retries ' + endpoint)
+            print('{} (attempt {} of {}), retrying in {}s'.format(error, attempt + 1, self.maxRetries + 1, round(delay, 1)), datetime.now())
+            time.sleep(delay)
+        raise error
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request('POST', url, **kwargs)
@@ -1,34 +1,57 @@
 #!/usr/bin/env python3
 
-import os, sys, glob, requests, datetime, gzip, json, enum, getopt
-from utils import fetchActors, fetchGear, fetchDamageEvents, fetchAbilityEvents, fetchReportList, fetchReportSummary # graphql queries
+import os, sys, datetime, time, json, getopt, heapq, math, atexit, zlib, functools
+from bisect import bisect_right
+try:
+    import numpy as np  # optional, speeds up classifying damage events
+except ImportError:
+    np = None
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from utils import fetchReportList, getDamageEventsFilter, getSpecFilter, getActorFilter # graphql queries
+from utils import fetchReportActors, fetchReportLoad # a report's actors, and everything it's scored with in one graphql query
+from utils import fetchReportSummaries, prefetchReportLoads, REPORT_BATCH_SIZE # batched graphql queries
+from utils import setResponseCache, getAPIStats, FetchError
+from summaries import ReportSummaryIndex, ReportSummaryStore
+from summaries import getJSONFromGZIPFile, getValuesFromJSONLFile, writeValuesToJSONLFile, writeCursor
+from responsecache import ResponseCache
+from resultstore import ResultStore, RESULT_STORE_FILE, CURSE_MODES
+from progress import ProgressReporter
+from profiler import profiler
 from utils import MagicSchool, enchantData
-from jsonpath_ng import jsonpath, parse
+from jsonpath_ng import parse
 from terminaltables import AsciiTable
-from variables import apiKey
 
 verbose = False
+resultStore = None  # set in MAIN with -w
 MAX_REPORTS = 50000
+REPORT_SUMMARY_ATTEMPTS = 3  # times a report summary is fetched before it's given up on
+CHECKPOINT_INTERVAL = 60  # seconds between checkpoint writes
+REPORT_LOAD_RETRIES = 2  # times a report the api answered with an error is tried again before it's skipped
+REPORT_RETRY_DELAY = 10  # seconds before trying such a report again
+TABLE_INTERVAL = 300  # seconds between redrawing tables that changed
+IMMUNE_CASTS = 50  # a school is immune once this many casts all missed
+CONFIDENCE_Z = 1.96  # ~95% confidence intervals
+MIN_CONFIDENCE_HITS = 50  # hits needed before trusting a confidence interval
+curseNames = {17937: 'Curse of Shadow', 11722: 'Curse of Elements'}
 
 class FriendlyActor:
     def __init__(self, actor: dict):
         self.id = actor.get('id')
         self.name = actor.get('name')
         self.gear = actor.get('gear')
-        self.gearValues = self.getGearValues()
+        with profiler.timer('gear values'):
+            self.gearValues = self.getGearValues()
 
     def getGearValues(self):
         hitValue = 89  # Hit from talents
         spellPenValue = 0
         for item in self.gear:
-            itemID = item.get('id')
             hitValue += enchantData.get(item.get('permanentEnchant'), 0)
-            for jsonItem in jsonItems:
-                if jsonItem['id'] == itemID:
-                    if 'spellHit' in jsonItem:
-                        hitValue += jsonItem['spellHit']
-                    if 'spellPenetration' in jsonItem:
-                        spellPenValue += jsonItem['spellPenetration']
+            itemValues = itemIndex.get(item.get('id'))
+            if itemValues != None:
+                hitValue += itemValues.get('spellHit', 0)
+                spellPenValue += itemValues.get('spellPenetration', 0)
         if hitValue > 99:
             hitValue = 99
         return {'spellHit': hitValue, 'spellPen': spellPenValue}
@@ -43,230 +66,465 @@ class DebuffEvent:
         isTimed = self.sTime <= time <= self.eTime
         return damage * self.mod if isTimed else -1
 
+# A list of DebuffEvents flattened into non-overlapping segments so the active
+# modifier at any time can be found with a binary search instead of a scan.
+# Where windows overlap, the one that came first in the list wins, exactly like
+# walking the list and taking the first match. Timestamps are integer ms.
+class DebuffTimeline:
+    def __init__(self, debuffEvents: list):
+        self.starts = []  # segment start times, sorted
+        self.mods = []  # modifier of each segment, None if nothing is active
+
+        # windows are inclusive so they end at eTime + 1 as half-open segments
+        windows = sorted((e.sTime, i, e.eTime + 1, e.mod) for i, e in enumerate(debuffEvents) if e.sTime <= e.eTime)
+        points = sorted(set([w[0] for w in windows] + [w[2] for w in windows]))
+        active = []  # heap of (list index, end, mod)
+        w = 0
+        for point in points:
+            while w < len(windows) and windows[w][0] == point:
+                heapq.heappush(active, (windows[w][1], windows[w][2], windows[w][3]))
+                w += 1
+            while active and active[0][1] <= point:
+                heapq.heappop(active)
+            mod = active[0][2] if active else None
+            if not self.mods or self.mods[-1] != mod:
+                self.starts.append(point)
+                self.mods.append(mod)
+
+        if np != None:
+            self.startsArray = np.array(self.starts, dtype=np.int64)
+            self.modsArray = np.array([np.nan] + [np.nan if mod == None else mod for mod in self.mods], dtype=np.float64)
+
+    def getMod(self, time: int):
+        i = bisect_right(self.starts, time) - 1
+        return self.mods[i] if i >= 0 else None
+
+    # getMod for a numpy array of times, with NaN where nothing is active
+    def getMods(self, times):
+        return self.modsArray[np.searchsorted(self.startsArray, times, side='right')]
+
+emptyTimeline = DebuffTimeline([])
+
+
+# partial -> the (exclusive) range of damage percent that counts as that partial
+partialRanges = {
+    25: (22, 28),
+    50: (47, 53),
+    75: (72, 78),
+    100: (97, 103),
+}
+
+def mapPartialValue(damage):
+    for partial, (low, high) in partialRanges.items():
+        if low < damage < high:
+            return partial
+    return -1
+
+# Classify one cast (see Report.getCasts) as a miss (0), a partial (25, 50, 75,
+# 100) or None if it doesn't count. Only needs the cast itself, so the same rules
+# apply to live scrapes and to casts replayed from an exported dataset.
+def classifyCast(cast, hitTypes, skipCurses):
+    # skip players with spell penetration gear
+    if cast['spellPen'] > 0:
+        return None
+
+    # get damage event
+    damage = cast['unmitigated'] * hitTypes.get(cast['hitType'], 1)
+
+    # skip casts while the target has an excluded aura up (e.g. shazzrah's deaden magic)
+    if damage != 0 and cast['excluded']:
+        return None
+
+    # handle curses. if skipCurses is set, we'll ignore the cast. otherwise only
+    # misses and casts with the curse up count
+    if damage == 0:
+        curseDamage = 0
+    elif cast['curse'] != None:
+        curseDamage = damage * cast['curse']
+    else:
+        curseDamage = -1
+    if skipCurses:
+        if curseDamage > 0:
+            return None
+    else:
+        damage = curseDamage
+
+    if damage == 0: # miss
+        return 0
+    elif damage < 0:
+        return None
+
+    if cast['modifier'] != None:
+        damage = damage * cast['modifier']
+    partial = mapPartialValue(cast['amount'] * 100 / damage)
+    return partial if partial > 0 else None
+
+# each enemy of `enemyIDs` (by gameID) -> its actor id in a report with `actors`,
+# 0 if the enemy isn't in the report
+def getEnemyActors(enemyIDs, actors):
+    enemies = {}
+    for enemyID in enemyIDs:
+        try:
+            enemyActor = sorted(list(filter(lambda a: a.get('gameID') == enemyID, actors)),
+                                key=lambda a: a.get('id'))
+            enemies[enemyID] = enemyActor[-1].get('id')
+        except:
+            enemies[enemyID] = 0
+    return enemies
 
+# the events a Report for `specs` needs, as (alias, dataType, filterExpression,
+# hostilityType, abilityID) for fetchReportLoad: gear and damage of each spec's
+# players, and curses, damage modifiers and excluded auras on enemies (by
+# hostility and aura).
+#
+# with the report's `actors` the filters are narrowed to actor ids: gear and
+# damage from the spec's players (source.id), damage and auras on the encounter's
+# enemies (target.id). a report without those enemies needs no events at all, and
+# specs without players in it are left out. without `actors` (a report loaded in
+# a single query, see Report) players are filtered by spec and damage to other
+# targets is dropped client-side. actor ids are numbered per report, and names
+# aren't safe to filter on: reports keep the names of the client's language and
+# zone.json has misspellings (Kurinaxx).
+#
+# the rest is always dropped client-side (getDamageEvents, classifyCast):
+#   - excluded auras: misses during e.g. deaden magic still count, so the
+#     targetAurasAbsent argument would drop casts we need
+#   - dot ticks: the api's filter expressions have no documented field for
+#     ticks, and an expression it rejects fails the whole query
+#   - hit types: every hit type is classified, so there's nothing to leave out
+def getReportEventRequests(encounter, specs, actors=None):
+    targetFilter = ''
+    if actors != None:
+        enemyActorIDs = sorted(set(actorID for actorID in getEnemyActors([enemy.get('id') for enemy in encounter.get('enemies')], actors).values() if actorID))
+        if len(enemyActorIDs) == 0:
+            return []
+        targetFilter = getActorFilter('target', enemyActorIDs)
+
+    eventRequests = []
+    for spec in specs:
+        sourceFilter = getSpecFilter(spec.get('name'))
+        if actors != None:
+            sourceIDs = [actor.get('id') for actor in actors if actor.get('icon') == spec.get('icon')]
+            if len(sourceIDs) == 0:
+                continue
+            sourceFilter = ' and '.join([sourceFilter, getActorFilter('source', sourceIDs)])
+        # one field per spec, so the same fields (and cached responses) are used whichever specs are pending
+        eventRequests.append(('gear' + spec.get('name'), 'CombatantInfo', sourceFilter, None, None))
+        spellIDQuery = 'ability.id in ({})'.format(', '.join(str(spell) for spell in spec.get('spellIDs')))
+        damageFilter = getDamageEventsFilter(spec.get('name'), spellIDQuery)
+        if actors != None:
+            damageFilter = ' and '.join([damageFilter, getActorFilter('source', sourceIDs), targetFilter])
+        eventRequests.append(('damage' + spec.get('name'), 'DamageDone', damageFilter, None, None))
+        if spec.get('curseID') != None:
+            eventRequests.append(('debuffs' + str(spec.get('curseID')), 'Debuffs', targetFilter, 'Enemies', spec.get('curseID')))
+        for dmgMod in spec.get('dmgMods'):
+            eventRequests.append(('debuffs' + str(dmgMod.get('id')), 'Debuffs', targetFilter, 'Enemies', dmgMod.get('id')))
+    if len(eventRequests) == 0:
+        return []
+    for enemy in encounter.get('enemies'):
+        for aura in enemy.get('excludeAuras', []):
+            eventRequests.append((aura.get('type') + str(aura.get('id')), aura.get('type').capitalize(), targetFilter, 'Enemies', aura.get('id')))
+
+    # specs can share an aura (e.g. curse of elements for fire and frost)
+    return list({eventRequest[0]: eventRequest for eventRequest in eventRequests}.values())
+
+# A report is loaded once per encounter. Actors, gear and everything per spec
+# (damage events, curses, damage modifiers) and excluded auras are fetched up
+# front and shared by every enemy of the encounter. With the response cache the
+# report was prefetched in a batch (see EncounterScrape.submitNext), actors
+# first, so its events are filtered on actor ids and replayed from the cache.
+# Without it everything comes in a single request filtered by spec, since
+# fetching the actors first would take a second request per report. Raises
+# FetchError if the report can't be loaded completely.
 class Report:
-    def __init__(self, options, reportCode: str, spec: dict, encounterID: int, enemyIDs: list):
+    def __init__(self, options, reportCode: str, encounter: dict, specs: list):
         self.options = options
         self.reportCode = reportCode
-        self.spec = spec
-        self.spellIDQuery = 'ability.id in ({})'.format(', '.join(str(spell) for spell in self.spec.get('spellIDs')))
-        self.encounterID = encounterID
-        self.enemyIDs = enemyIDs
-        self.actors, self.enemyID = self.getActors()
-        self.curseEvents = self.getCurseUptime()
-        self.damageModifiers = self.getDamageModifiers()
-
-    def getActors(self):
+        self.encounterID = encounter.get('id')
+        self.enemyIDs = [enemy.get('id') for enemy in encounter.get('enemies')]
+        self.excludeAuras = {enemy.get('id'): enemy.get('excludeAuras', []) for enemy in encounter.get('enemies')}
+        with profiler.timer('load report'):
+            if options.get('useCache'):
+                eventRequests = getReportEventRequests(encounter, specs, fetchReportActors(reportCode))
+            else:
+                eventRequests = getReportEventRequests(encounter, specs)
+            self.actors, self.events = fetchReportLoad(reportCode, self.encounterID, eventRequests)
+        self.enemies = getEnemyActors(self.enemyIDs, self.actors)
+        self.friendlyActors = {}  # spec name -> [FriendlyActor]
+        self.curseEvents = {}  # curseID -> {enemy actor id: DebuffTimeline}
+        self.damageModifiers = {}  # spec name -> {enemy actor id: DebuffTimeline}
+        self.auraEvents = {}  # (aura type, aura id) -> {actor id: DebuffTimeline}
+        self.casts = {}  # enemy gameID -> {MagicSchool: [cast]}, only kept when exporting
+
+    def getFriendlyActors(self, spec):
+        icon = spec.get('icon')
+        if spec.get('name') in self.friendlyActors:
+            return self.friendlyActors[spec.get('name')]
+
+        gear = self.events.get('gear' + spec.get('name'), [])
         actorList = []
-        try:
-            actors = fetchActors(self.reportCode). \
-                get('data', {}). \
-                get('reportData', {}). \
-                get('report', {}). \
-                get('masterData', {}). \
-                get('actors', [])
-        except AttributeError:
-            return [[], []]
-        try:
-            gear = fetchGear(self.reportCode, self.encounterID). \
-                get('data', {}). \
-                get('reportData', {}). \
-                get('report', {}). \
-                get('events', {}). \
-                get('data', [])
-        except AttributeError:
-            return [[], []]
-
-        if actors == None:
-            return [[], []]
-
-        for actor in filter(lambda a: a.get('icon') == self.spec.get('icon'), actors):
+        for actor in filter(lambda a: a.get('icon') == icon, self.actors):
             try:
-                actor['gear'] = next(a for a in gear if a.get('sourceID') == actor.get('id')).get('gear')
+                actor = dict(actor, gear=next(a for a in gear if a.get('sourceID') == actor.get('id')).get('gear'))
             except Exception:
                 continue
             actorList.append(FriendlyActor(actor))
-        try:
-            enemyID = sorted(list(filter(lambda a: a.get('gameID') in self.enemyIDs, actors)),
-                             key=lambda a: a.get('id'))
-            enemyID = enemyID[-1].get('id')
-        except:
-            enemyID = 0
-        return [actorList, enemyID]
-
-    # FIXME: dumb hack for shazzrahs deaden magic. should clean up someday, but not today.
-    def getDeadenMagicUptime(self):  
-        if not self.enemyID:
-            return []
-            
-        url = "https://classic.warcraftlogs.com:443/v1/report/tables/buffs/{reportCode}?start=0&end=999999999999&hostility=1&by=source&abilityid={abilityID}&encounter={encounterID}&api_key={apiKey}".format(
-            reportCode=self.reportCode, abilityID=19714, encounterID=self.encounterID, apiKey=apiKey)
-
-        try:
-            response = requests.get(url)
-            response.close()
-            data = response.json()
-            data = next(filter(lambda event: event.get('id') == self.enemyID, data.get('auras', [])))
-            events = [DebuffEvent(event.get('startTime'), event.get('endTime')) for event in data.get('bands')]
-            return events
-        except:
-            return []
-
-    def getCurseUptime(self):  # Selects only one entry for simplicity
-        if not self.enemyID:
-            return []
-            
-        if self.spec.get('curseID') == None:
-            return []
-
-        url = "https://classic.warcraftlogs.com:443/v1/report/tables/debuffs/{reportCode}?start=0&end=999999999999&hostility=1&by=source&abilityid={abilityID}&encounter={encounterID}&api_key={apiKey}".format(
-            reportCode=self.reportCode, abilityID=self.spec.get('curseID'), encounterID=self.encounterID, apiKey=apiKey)
-
-        try:
-            response = requests.get(url)
-            response.close()
-            data = response.json()
-            data = next(filter(lambda event: event.get('id') == self.enemyID, data.get('auras', [])))
-            events = [DebuffEvent(event.get('startTime'), event.get('endTime')) for event in data.get('bands')]
-            return events
-        except:
-            return []
-
-    def getDamageModifiers(self):
-        debuffEvents = []
-        for dmgMod in self.spec.get('dmgMods'):
-            url = "https://classic.warcraftlogs.com:443/v1/report/events/debuffs/{reportCode}?start=0&end=999999999999&hostility=1&by=source&abilityid={abilityID}&encounter={encounterID}&api_key={apiKey}".format(
-                reportCode=self.reportCode, abilityID=dmgMod.get('id'), encounterID=self.encounterID, apiKey=apiKey)
-            try:
-                response = requests.get(url)
-                response.close()
-                data = response.json().get('events', [])
-            except:
-                return []
-
-            stackCount = 0
-            startingTiming = 0
-            for event in filter(lambda e: e.get('targetID') == self.enemyID, data):
+        self.friendlyActors[spec.get('name')] = actorList
+        return actorList
+
+    # when an aura was up on each target, from the apply and remove events loaded
+    # under `alias`. an aura that's removed without being applied was up from the
+    # start, one that's never removed stays up until the end
+    def getAuraTimelines(self, alias):
+        bands = {}
+        startTimes = {}
+        for event in self.events.get(alias, []):
+            targetID = event.get('targetID')
+            if event.get('type') in ('applybuff', 'applydebuff'):
+                startTimes.setdefault(targetID, event.get('timestamp'))
+            elif event.get('type') in ('removebuff', 'removedebuff'):
+                bands.setdefault(targetID, []).append(DebuffEvent(startTimes.pop(targetID, 0), event.get('timestamp')))
+        for targetID, startTime in startTimes.items():
+            bands.setdefault(targetID, []).append(DebuffEvent(startTime, 999999999999))
+        return {targetID: DebuffTimeline(targetBands) for targetID, targetBands in bands.items()}
+
+    # uptime of a buff or debuff on every actor, e.g. shazzrah's deaden magic.
+    # `aura` is an entry from an enemy's `excludeAuras` in zone.json
+    def getAuraUptime(self, aura):
+        auraKey = (aura.get('type'), aura.get('id'))
+        if auraKey not in self.auraEvents:
+            with profiler.timer('excluded auras'):
+                self.auraEvents[auraKey] = self.getAuraTimelines(aura.get('type') + str(aura.get('id')))
+        return self.auraEvents[auraKey]
+
+    # true if the target had one of the enemy's `excludeAuras` up at `time`.
+    # casts during e.g. deaden magic are resisted differently and would skew the results
+    def hasExcludedAura(self, enemyID, targetID, time):
+        for aura in self.excludeAuras.get(enemyID, []):
+            if self.getAuraUptime(aura).get(targetID, emptyTimeline).getMod(time) != None:
+                return True
+        return False
+
+    def getCurseUptime(self, spec):  # Selects only one entry for simplicity
+        curseID = spec.get('curseID')
+        if curseID == None:
+            return {}
+
+        if curseID not in self.curseEvents:
+            with profiler.timer('curses'):
+                self.curseEvents[curseID] = self.getAuraTimelines('debuffs' + str(curseID))
+        return self.curseEvents[curseID]
+
+    def getDamageModifiers(self, spec):
+        if spec.get('name') in self.damageModifiers:
+            return self.damageModifiers[spec.get('name')]
+
+        debuffEvents = {}
+        enemyActorIDs = set(self.enemies.values())
+        for dmgMod in spec.get('dmgMods'):
+            data = self.events.get('debuffs' + str(dmgMod.get('id')), [])
+
+            # stacks are tracked separately for each enemy
+            stackCount = {}
+            startingTiming = {}
+            for event in filter(lambda e: e.get('targetID') in enemyActorIDs, data):
+                targetID = event.get('targetID')
+                targetEvents = debuffEvents.setdefault(targetID, [])
                 if event.get('type') == 'applydebuff':
-                    startingTiming = event['timestamp'] + 1
-                    stackCount = 1
+                    startingTiming[targetID] = event['timestamp'] + 1
+                    stackCount[targetID] = 1
                 if event.get('type') == 'applydebuffstack':
-                    debuffEvents.append(
-                        DebuffEvent(startingTiming, event.get('timestamp'), 1 + stackCount * dmgMod.get('modifier')))
-                    startingTiming = event.get('timestamp') + 1
-                    stackCount += 1
+                    targetEvents.append(
+                        DebuffEvent(startingTiming.get(targetID, 0), event.get('timestamp'), 1 + stackCount.get(targetID, 0) * dmgMod.get('modifier')))
+                    startingTiming[targetID] = event.get('timestamp') + 1
+                    stackCount[targetID] = stackCount.get(targetID, 0) + 1
                 if event.get('type') == 'removedebuff':
-                    debuffEvents.append(
-                        DebuffEvent(startingTiming, event.get('timestamp'), 1 + stackCount * dmgMod.get('modifier')))
-                    stackCount = 0
+                    targetEvents.append(
+                        DebuffEvent(startingTiming.get(targetID, 0), event.get('timestamp'), 1 + stackCount.get(targetID, 0) * dmgMod.get('modifier')))
+                    stackCount[targetID] = 0
+        debuffEvents = {targetID: DebuffTimeline(events) for targetID, events in debuffEvents.items()}
+        self.damageModifiers[spec.get('name')] = debuffEvents
         return debuffEvents
 
-    def mapPartialValue(self, damage):
-        if 22 < damage < 28:
-            return 25
-        if 47 < damage < 53:
-            return 50
-        if 72 < damage < 78:
-            return 75
-        if 97 < damage < 103:
-            return 100
-        return -1
-
-    def getCurrentActor(self, id):
-        return next(filter(lambda actor: actor.id == id, self.actors))
-
-    def getCurrentTimestamp(self, time, damage, debuffList, defaultMod=-1):
-        if damage == 0:
-            return 0
-        for debuffClass in debuffList:
-            tempDamage = debuffClass.getValue(time, damage)
-            if tempDamage > 0:
-                return tempDamage
-        #  Return -1 if current check is for curse, return unmodified damage if current check is for damage multipliers
-        if defaultMod > 0:
-            return damage * defaultMod
-        else:
-            return -1
-
-    def getDamageEvents(self):
-        hitData = {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}
-        try:
-            events = fetchDamageEvents(self.reportCode, self.encounterID, self.spec.get('name'), self.spellIDQuery). \
-                get('data', {}). \
-                get('reportData', {}). \
-                get('report', {}). \
-                get('events', {}). \
-                get('data', [])
-        except AttributeError:
-            print('attributeError - reportCode: ' + self.reportCode + ', encounterID: ' + str(self.encounterID) + ', spec: ' + self.spec.get('name'))
-            return hitData
-        events = list(filter(lambda event: event.get('sourceID') in [actor.id for actor in self.actors] and
-                                           event.get('targetID') == self.enemyID and not event.get('tick'), events))
+    # returns a hitData table per curse mode for each enemy in `enemyIDs` (by gameID)
+    def getDamageEvents(self, spec, enemyIDs):
+        hitDataByEnemy = {enemyID: {curses: {0: 0, 25: 0, 50: 0, 75: 0, 100: 0} for curses in self.options.get('curseModes')} for enemyID in enemyIDs}
+        if len(self.actors) == 0:
+            return hitDataByEnemy
+
+        actors = {actor.id: actor for actor in self.getFriendlyActors(spec)}
+        targets = {self.enemies[enemyID]: enemyID for enemyID in enemyIDs if self.enemies.get(enemyID)}
+        with profiler.timer('damage events'):
+            events = self.events.get('damage' + spec.get('name'), [])
+            events = list(filter(lambda event: event.get('sourceID') in actors and
+                                               event.get('targetID') in targets and not event.get('tick'), events))
+        if len(events) == 0:
+            return hitDataByEnemy
+
+        curseEvents = self.getCurseUptime(spec)
+        damageModifiers = self.getDamageModifiers(spec)
+        eventsByTarget = {}
         for event in events:
-            actor = self.getCurrentActor(event.get('sourceID'))
-            gearValues = actor.getGearValues()
-            hitValue = gearValues['spellHit']
-            spellPenValue = gearValues['spellPen']
-            #hitData = {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}
-
-            # skip players with spell penetration gear
-            if spellPenValue > 0:
-                continue
+            eventsByTarget.setdefault(event.get('targetID'), []).append(event)
+
+        for targetID, targetEvents in eventsByTarget.items():
+            enemyID = targets[targetID]
+            curseTimeline = curseEvents.get(targetID, emptyTimeline)
+            modifierTimeline = damageModifiers.get(targetID, emptyTimeline)
+            # excluded auras are fetched here, before the classify timer starts
+            for aura in self.excludeAuras.get(enemyID, []):
+                self.getAuraUptime(aura)
+            with profiler.timer('classify'):
+                if np != None and not self.options.get('exportFile'):
+                    hitData = self.getHitDataVectorized(spec, enemyID, targetID, targetEvents, actors, curseTimeline, modifierTimeline)
+                else:
+                    casts = self.getCasts(spec, enemyID, targetID, targetEvents, actors, curseTimeline, modifierTimeline)
+                    hitData = self.getHitData(spec, casts)
+                    if self.options.get('exportFile'):
+                        self.casts.setdefault(enemyID, {}).setdefault(spec.get('magicSchool'), []).extend(casts)
+            profiler.count('damage events classified', len(targetEvents))
+            for curses in hitData:
+                for x in hitData[curses]: hitDataByEnemy[enemyID][curses][x] += hitData[curses][x]
+        return hitDataByEnemy
+
+    # one target's damage events with everything needed to classify them: who cast
+    # it, how hard it hit and which curse, damage modifier and excluded aura were up
+    def getCasts(self, spec, enemyID, targetID, events, actors, curseTimeline, modifierTimeline):
+        casts = []
+        for event in events:
+            actor = actors[event.get('sourceID')]
+            timestamp = event.get('timestamp')
+            casts.append({
+                'report': self.reportCode,
+                'encounter': self.encounterID,
+                'enemy': enemyID,
+                'school': spec.get('magicSchool').name.lower(),
+                'actor': actor.name,
+                'spellPen': actor.gearValues['spellPen'],
+                'timestamp': timestamp,
+                'ability': event.get('abilityGameID'),
+                'hitType': event.get('hitType'),
+                'unmitigated': event.get('unmitigatedAmount', 0),
+                'amount': event.get('amount') or 0,
+                'curse': curseTimeline.getMod(timestamp),
+                'modifier': modifierTimeline.getMod(timestamp),
+                'excluded': self.hasExcludedAura(enemyID, targetID, timestamp),
+            })
+        return casts
+
+    # classify one target's damage events into misses and partials, one event at a
+    # time, for each curse mode
+    def getHitData(self, spec, casts):
+        hitData = {}
+        for curses in self.options.get('curseModes'):
+            hitData[curses] = {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}
+            for cast in casts:
+                partial = classifyCast(cast, spec.get('hitTypes'), curses == 'withoutCurses')
+                if partial != None:
+                    hitData[curses][partial] += 1
+        return hitData
 
-            # get damage event
-            damage = event.get('unmitigatedAmount', 0) * self.spec.get('hitTypes').get(event.get('hitType'), 1)
+    # same as getCasts + getHitData, but the whole batch of events is classified with
+    # numpy array operations instead of a python loop. gives identical counts.
+    def getHitDataVectorized(self, spec, enemyID, targetID, events, actors, curseTimeline, modifierTimeline):
+        count = len(events)
+        timestamps = np.fromiter((event.get('timestamp') for event in events), dtype=np.int64, count=count)
+        hitTypes = np.fromiter((event.get('hitType') or -1 for event in events), dtype=np.int64, count=count)
+        unmitigated = np.fromiter((event.get('unmitigatedAmount', 0) for event in events), dtype=np.float64, count=count)
+        amounts = np.fromiter((event.get('amount') or 0 for event in events), dtype=np.float64, count=count)
+
+        # skip players with spell penetration gear
+        keep = np.fromiter((actors[event.get('sourceID')].gearValues['spellPen'] <= 0 for event in events), dtype=bool, count=count)
+
+        # get damage event
+        multipliers = np.ones(count)
+        for hitType, multiplier in spec.get('hitTypes').items():
+            multipliers[hitTypes == hitType] = multiplier
+        damage = unmitigated * multipliers
+
+        # skip casts while the target has an excluded aura up (e.g. shazzrah's deaden magic)
+        for aura in self.excludeAuras.get(enemyID, []):
+            auraActive = ~np.isnan(self.getAuraUptime(aura).get(targetID, emptyTimeline).getMods(timestamps))
+            keep &= ~((damage != 0) & auraActive)
+
+        curseMods = curseTimeline.getMods(timestamps)
+        cursed = (damage != 0) & ~np.isnan(curseMods)
+        modifierMods = modifierTimeline.getMods(timestamps)
+
+        hitData = {}
+        for curses in self.options.get('curseModes'):
+            # handle curses. without curses we'll ignore cursed casts. otherwise only
+            # misses and casts with the curse up count
+            if curses == 'withoutCurses':
+                curseKeep = keep & ~cursed
+                curseDamage = damage
+            else:
+                curseKeep = keep & ((damage == 0) | cursed)
+                curseDamage = np.where(cursed, damage * np.nan_to_num(curseMods, nan=1), damage)
 
-            # handle shazzrah hack for Deaden Magic 
-            if self.enemyIDs[0] == 12264: 
-                deadenMagicDamage = self.getCurrentTimestamp(event.get('timestamp'), damage, self.getDeadenMagicUptime())
-                if deadenMagicDamage > 0:
-                    continue
+            misses = curseKeep & (curseDamage == 0)
+            hits = curseKeep & (curseDamage > 0)
 
-            # handle curses. if skipCurses is set, we'll ignore the cast
-            curseDamage = self.getCurrentTimestamp(event.get('timestamp'), damage, self.curseEvents)
-            if self.options.get('skipCurses'):
-                if curseDamage > 0:
-                    continue
-            else:
-                damage = curseDamage
+            curseDamage = np.where(np.isnan(modifierMods), curseDamage * 1, curseDamage * np.nan_to_num(modifierMods, nan=1))
+            partials = np.divide(amounts * 100, curseDamage, out=np.zeros(count), where=hits)
 
-            if damage == 0: # miss
-                hitData[0] += 1
-                continue
-            elif damage < 0: 
-                continue
-            else:
-                damage = self.getCurrentTimestamp(event.get('timestamp'), damage, self.damageModifiers, 1)
-                eventAmount = event.get('amount')
-                partial = self.mapPartialValue(eventAmount * 100 / damage)
-                if partial > 0:
-                    #print('damage = ' + str(damage) + ', eventAmount = ' + str(eventAmount) + ', partial = ' + str(partial))
-                    hitData[partial] += 1
+            hitData[curses] = {0: int(misses.sum())}
+            for partial, (low, high) in partialRanges.items():
+                hitData[curses][partial] = int((hits & (partials > low) & (partials < high)).sum())
         return hitData
 
+# item id -> the item's spellHit/spellPenetration. items without either are left
+# out since they don't change our numbers
+def loadItemIndex(FilePath):
+    with open(FilePath) as itemFile:
+        jsonItems = json.load(itemFile)
+
+    index = {}
+    for jsonItem in jsonItems:
+        itemValues = {key: jsonItem[key] for key in ('spellHit', 'spellPenetration') if key in jsonItem}
+        if len(itemValues) > 0:
+            index[jsonItem['id']] = itemValues
+    return index
+
 def printUsage():
     print(
         '''
-Usage: main.py [-h | -d | -a | -r <file.json>] | [OPTIONS] <TARGETS>
+Usage: main.py [-h | -d | -a | -r <enemyID>] | [OPTIONS] <TARGETS> | [OPTIONS] -R <dataset.jsonl.gz> [TARGETS] | --merge <results.sqlite,...> [TARGETS]
 
 -h                      Show usage and exit (this screen)
 -d                      Display all zone information and exit (zones, encounters, enemies)
--r                      Display results from <file.json>
+-r  <enemyID>           Display an enemy's latest results and the runs they came from (or a <file.json> from before the result store)
 -a                      Display all results                       
+-R  <dataset.jsonl.gz>  Recompute results from a dataset written with -o, without scraping
+--merge <stores>        Sum the shards in result stores delimited by comma, display them and save them as a new run
 
 OPTIONS
 -v                      Verbose output (DEFAULT: False)
 -q                      Quiet mode. (DEFAULT: False)
--w                      Write results to the `results` directory (DEFAULT: False)
+-w                      Save results to `results/results.sqlite` as a new run (DEFAULT: False)
 -c                      Skip casts with a curse active (DEFAULT: False)
+-b                      Count casts both ways (with and without curses) in one pass, plus hits per curse (DEFAULT: False)
 -i                      Enemies to ignore delimited by comma (DEFAULT: None)
 -s  <spellCastLimit>    Stop scraping a school after number of casts reaches <spellCastLimit> (DEFAULT: 1000)
+-p  <width>             Also stop a school once the 95% confidence interval on its resistance is at most <width> points wide, or it's immune (DEFAULT: None)
 -m  <magicSchoolNames>  Magic school names delimited by comma (DEFAULT: arcane,fire,frost,nature,shadow)
+-j  <workers>           Number of reports to process concurrently (DEFAULT: 1)
+-x                      Don't use the response cache in `cache/responses.sqlite` (DEFAULT: False)
+-u                      Refresh the zone's report summary cache with newly uploaded reports (DEFAULT: False)
+-o  <dataset.jsonl.gz>  Append every counted cast to <dataset.jsonl.gz> (DEFAULT: None)
+-f                      Start from the first report instead of resuming from `cache/checkpoints` (DEFAULT: False)
+-t  <status.json>       Keep <status.json> up to date with the scrape's progress (DEFAULT: None)
+-P                      Print where the time went at exit: phase timers, api latency, bytes, cache hits (DEFAULT: False)
+-C  <file.prof>         Like -P, and write cProfile stats of every thread to <file.prof> (DEFAULT: None)
+--shard <i/N>           Only scrape the reports of shard i of N, to be combined with --merge (implies -w) (DEFAULT: None)
 
 TARGETS
--e  <enemyID>           Scrape one <enemyID> OR
--n  <encounterID>       Scrape all enemies in <encounterID> OR
--z  <zoneID>            Scrape all enemies in <zoneID>
+-e  <enemyIDs>          Scrape enemies delimited by comma AND/OR
+-n  <encounterIDs>      Scrape all enemies in encounters delimited by comma AND/OR
+-z  <zoneIDs>           Scrape all enemies in zones delimited by comma
+
+Targets can be combined. Everything is scraped by one pool of -j workers sharing
+the api budget and response cache, and every encounter resumes from its checkpoint.
 
 EXAMPLE
  Scrape arcane and nature resistance of Shazzrah:
@@ -280,11 +538,21 @@ def getOptions(argv):
     options = {
         "quiet": False,
         "verbose": False,
-        "skipCurses": False,
+        "curseModes": ['withCurses'],  # 'withCurses' and/or 'withoutCurses' (-c, -b)
         "writeResults": False,
         "spellCastLimit": 1000,
-        "zoneID": None,
-        "zoneName": None,
+        "confidenceWidth": None,
+        "workers": 1,
+        "useCache": True,
+        "refreshCache": False,
+        "exportFile": None,
+        "reprocessFile": None,
+        "ignoreCheckpoint": False,
+        "statusFile": None,
+        "profile": False,
+        "cProfileFile": None,
+        "shard": None,
+        "mergeFiles": None,
         "ignoreEnemies": [],
         "encounters": [],
         "specs": [],
@@ -292,16 +560,16 @@ def getOptions(argv):
     
     # parse args
     try:
-        opts,args = getopt.getopt(sys.argv[1:], "hqdwar:s:vcm:e:i:z:n:")
+        opts,args = getopt.getopt(sys.argv[1:], "hqdwar:s:vcbm:e:i:z:n:j:xuo:R:fp:t:PC:", ["shard=", "merge="])
     except getopt.GetoptError:
         printUsage()
         sys.exit(2)
 
     # temp values
     magicSchoolNames = 'arcane,fire,frost,nature,shadow'
-    enemyID = None
-    zoneID = None
-    encounterID = None
+    enemyIDs = []
+    zoneIDs = []
+    encounterIDs = []
 
     for opt, arg in opts:
         if opt == '-h':
@@ -314,10 +582,21 @@ def getOptions(argv):
             displayZoneInfo()
             sys.exit(0)
         elif opt == '-r':
-            with open(arg) as f:
-                resultsJson = json.load(f)
-            table_instance = AsciiTable(resultsJson.get('tables'), resultsJson.get('enemyName'))
-            print(table_instance.table)
+            # results files from before the result store can still be displayed
+            if arg.endswith('.json'):
+                if not os.path.exists(arg):
+                    print('ERROR: No such results file: ' + arg)
+                    sys.exit(4)
+                with open(arg) as f:
+                    resultsJson = json.load(f)
+                table_instance = AsciiTable(resultsJson.get('tables'), resultsJson.get('enemyName'))
+                print(table_instance.table)
+            elif arg.isdigit():
+                displayEnemyResults(int(arg))
+            else:
+                print('ERROR: Invalid enemy id: ' + arg + ' (expected an enemy id or a <file.json>)')
+                printUsage()
+                sys.exit(4)
             sys.exit(0)
         elif opt == '-w':
             options['writeResults'] = True
@@ -331,17 +610,52 @@ def getOptions(argv):
             options['quiet'] = True
         elif opt == '-c':
             print('Ignoring casts with a curse active')
-            options['skipCurses'] = True
+            options['curseModes'] = ['withoutCurses']
+        elif opt == '-b':
+            print('Counting casts with and without a curse active')
+            options['curseModes'] = ['withCurses', 'withoutCurses']
         elif opt == '-s':
             options['spellCastLimit'] = int(arg)
+        elif opt == '-p':
+            options['confidenceWidth'] = float(arg)
+        elif opt == '-j':
+            options['workers'] = max(int(arg), 1)
+        elif opt == '-x':
+            options['useCache'] = False
+        elif opt == '-u':
+            options['refreshCache'] = True
+        elif opt == '-f':
+            options['ignoreCheckpoint'] = True
+        elif opt == '-P':
+            options['profile'] = True
+        elif opt == '-C':
+            options['profile'] = True
+            options['cProfileFile'] = arg
+        elif opt == '-t':
+            options['statusFile'] = arg
+        elif opt == '-o':
+            options['exportFile'] = arg
+        elif opt == '-R':
+            options['reprocessFile'] = arg
+        elif opt == '--shard':
+            shard = [int(x) for x in arg.split('/')] if all(x.isdigit() for x in arg.split('/')) else []
+            if len(shard) != 2 or not 1 <= shard[0] <= shard[1]:
+                print('ERROR: Invalid shard: ' + arg + ' (expected i/N, e.g. 1/4)')
+                printUsage()
+                sys.exit(4)
+            options['shard'] = shard
+            options['writeResults'] = True
+        elif opt == '--merge':
+            options['mergeFiles'] = arg.split(',')
+            options['writeResults'] = True
         elif opt == '-m':
             magicSchoolNames = arg.lower()
         elif opt == '-z':
-            zoneID = int(arg)
+            zoneIDs += [int(x) for x in arg.split(',')]
         elif opt == '-n':
-            encounterID = int(arg)
+            encounterIDs += [int(x) for x in arg.split(',')]
         elif opt == '-e':
-            enemyID = int(arg)
+            enemyIDs += [int(x) for x in arg.split(',')]
 
     # build up specs based on selected magic schools. each magic school
     # is associated with a certain player spec, spells, curses, etc
@@ -443,54 +757,51 @@ def getOptions(argv):
             printUsage()
             sys.exit(4)
         
-    # handle zone, encounters and enemies
+    # handle zone, encounters and enemies. targets can be combined, each
+    # encounter is scraped once for all of its selected enemies
     with open('zone.json') as zone_data:
         zones = json.load(zone_data)
 
+    if len(zoneIDs) + len(encounterIDs) + len(enemyIDs) == 0:
+        if options['reprocessFile'] != None or options['mergeFiles'] != None:
+            return(options)
+        print('ERROR: Must specify a zone, encounter or enemy')
+        printUsage()
+        sys.exit(3)
+
     # by zone
-    if zoneID != None:
-        for zone in zones:
-            if zone['id'] == zoneID:
-                options['zoneID'] = zone['id']
-                options['zoneName'] = zone['name']
-                options['encounters'] = zone['encounters']
-        
-        if options['zoneID'] == None:
+    for zoneID in zoneIDs:
+        zone = next((zone for zone in zones if zone['id'] == zoneID), None)
+        if zone == None:
             print('ERROR: Invalid zoneID: ' + str(zoneID))
             print('')
             print('Try -l to find a valid zoneID')
             sys.exit(4)
+        for encounter in zone['encounters']:
+            addEncounter(options, zone, encounter, encounter['enemies'])
+
     # by encounter
-    elif encounterID != None:
+    for encounterID in encounterIDs:
+        found = False
         for zone in zones:
             for encounter in zone['encounters']:
                 if encounter['id'] == encounterID:
-                    options['zoneID'] = zone['id']
-                    options['zoneName'] = zone['name']
-                    options['encounters'].append(encounter)
-        
-        if len(options['encounters']) == 0:
+                    addEncounter(options, zone, encounter, encounter['enemies'])
+                    found = True
+
+        if not found:
             print('ERROR: Invalid encounterID: ' + str(encounterID))
             print('')
             print('Try -l to find a valid encounterID')
             sys.exit(4)
+
     # by enemy
-    elif enemyID != None:
+    for enemyID in enemyIDs:
         for zone in zones:
             for encounter in zone['encounters']:
                 for enemy in encounter['enemies']:
                     if enemyID == enemy['id']:
-                        options['zoneID'] = zone['id']
-                        options['zoneName'] = zone['name']
-                        options['encounters'].append({
-                            'id': encounter['id'],
-                            'name': encounter['name'],
-                            'enemies': [ {'id': enemy['id'], 'name': enemy['name'], 'level': enemy['level']} ]
-                        })
-    else:
-        print('ERROR: Must specify a zone, encounter or enemy')
-        printUsage()
-        sys.exit(3)
+                        addEncounter(options, zone, encounter, [ enemy ])
 
     if len(options['encounters']) == 0:
         print('ERROR: Failed to find any encounters')
@@ -498,13 +809,38 @@ def getOptions(argv):
 
     return(options)
 
-# display all results (amalgamated)
+# add `enemies` of an encounter to the scrape, joining the encounter if it's already there
+def addEncounter(options, zone, encounter, enemies):
+    for scrapeEncounter in options['encounters']:
+        if scrapeEncounter['id'] == encounter['id']:
+            scrapeEncounter['enemies'] += [enemy for enemy in enemies if enemy not in scrapeEncounter['enemies']]
+            return
+
+    options['encounters'].append({
+        'id': encounter['id'],
+        'name': encounter['name'],
+        'zoneID': zone['id'],
+        'enemies': list(enemies)
+    })
+
+# the result store -a and -r read from, opened read-only. without a store yet,
+# results from before the store are read from their json files into memory
+def getDisplayResultStore():
+    if os.path.exists(RESULT_STORE_FILE):
+        return ResultStore(readOnly=True)
+    resultStore = ResultStore(':memory:', importResults=False)
+    resultStore.importJSONResults(os.path.dirname(RESULT_STORE_FILE))
+    return resultStore
+
+# display all results (amalgamated): the latest run of every enemy in the result store
 def displayAllResults():
-    table_data_without_curses = []
-    table_data_without_curses.append(('enemy', 'arcane', 'fire', 'frost', 'nature', 'shadow'))
+    resultStore = getDisplayResultStore()
+    latestResults = resultStore.getLatestResults()
 
-    table_data_with_curses = []
-    table_data_with_curses.append(('enemy', 'arcane', 'fire', 'frost', 'nature', 'shadow'))
+    tableData = {}
+    for curses in CURSE_MODES:
+        tableData[curses] = []
+        tableData[curses].append(('enemy', 'arcane', 'fire', 'frost', 'nature', 'shadow'))
     
     with open('zone.json') as zone_data:
         zones = json.load(zone_data)
@@ -513,12 +849,12 @@ def displayAllResults():
         for encounter in zone['encounters']:
             for enemy in encounter['enemies']:
                 enemyName = enemy.get('name') + ' (' + str(enemy.get('id')) + ')'
-                resultsWithCurses = 'results/withCurses/' + str(enemy.get('id')) + '.json'
-                if os.path.exists(resultsWithCurses):
-                    with open(resultsWithCurses) as f:
-                        resultsJson = json.load(f)
-                    tableJson = resultsJson.get('tables')
-                    table_data_with_curses.append((
+                for curses in CURSE_MODES:
+                    if (enemy.get('id'), curses) not in latestResults:
+                        continue
+                    runID, hitTables = latestResults[(enemy.get('id'), curses)]
+                    tableJson = getResultsTable(enemy, hitTables)
+                    tableData[curses].append((
                         enemyName,
                         tableJson[1][1],
                         tableJson[2][1],
@@ -527,22 +863,39 @@ def displayAllResults():
                         tableJson[5][1]
                     ))
                 
-                resultsWithoutCurses = 'results/withoutCurses/' + str(enemy.get('id')) + '.json'
-                if os.path.exists(resultsWithoutCurses):
-                    with open(resultsWithoutCurses) as f:
-                        resultsJson = json.load(f)
-                    tableJson = resultsJson.get('tables')
-                    table_data_without_curses.append((
-                        enemyName,
-                        tableJson[1][1],
-                        tableJson[2][1],
-                        '?', #tableJson[3][1], # frost is broke right now
-                        tableJson[4][1],
-                        tableJson[5][1]
-                    ))
-                
-    table_instance = AsciiTable(table_data_without_curses, 'Resistances (without curses)')
+    table_instance = AsciiTable(tableData['withoutCurses'], 'Resistances (without curses)')
     print(table_instance.table)
+    if len(tableData['withCurses']) > 1:
+        table_instance = AsciiTable(tableData['withCurses'], 'Resistances (with curses)')
+        print(table_instance.table)
+
+# display an enemy's latest tables from the result store and the runs it has results from
+def displayEnemyResults(enemyID):
+    enemy = {'id': enemyID, 'name': str(enemyID), 'level': 63}
+    with open('zone.json') as zone_data:
+        for zone in json.load(zone_data):
+            for encounter in zone['encounters']:
+                for zoneEnemy in encounter['enemies']:
+                    if zoneEnemy.get('id') == enemyID:
+                        enemy = zoneEnemy
+
+    resultStore = getDisplayResultStore()
+    latestResults = resultStore.getLatestResults(enemyID)
+    if len(latestResults) == 0:
+        print('No results for ' + enemy.get('name') + ' (' + str(enemyID) + ')')
+        return
+    for curses in CURSE_MODES:
+        if (enemyID, curses) in latestResults:
+            runID, hitTables = latestResults[(enemyID, curses)]
+            enemyName = enemy.get('name') + (' (without curses)' if curses == 'withoutCurses' else ' (with curses)') + ' - run ' + str(runID)
+            print(AsciiTable(getResultsTable(enemy, hitTables), enemyName).table)
+
+    table_data = [('run', 'curses', 'shard', 'started', 'updated', 'casts', 'command')]
+    for run in resultStore.getRuns(enemyID):
+        table_data.append((run.get('runID'), run.get('curses'), run.get('shard') or '',
+            datetime.datetime.fromtimestamp(run.get('started')).strftime('%Y-%m-%d %H:%M') if run.get('started') else '?',
+            datetime.datetime.fromtimestamp(run.get('updated')).strftime('%Y-%m-%d %H:%M'), run.get('casts'), run.get('command') or ''))
+    print(AsciiTable(table_data, 'Runs').table)
                     
 # List all bosses (-l option)
 def displayZoneInfo(zoneID=0):
@@ -560,93 +913,197 @@ def displayZoneInfo(zoneID=0):
                 print('### Enemy: {} ({})'.format(enemy['name'], enemy['id']))
         print('')
 
-# for every report in a zone, create a summary and add it to a giant array. then save the array
-# as a JSON file in `cache/`. then gzip it so github doesn't get mad.
+# for every report in a zone, create a summary and append it to `cache/<zoneID>.jsonl.gz`
+# (gzipped JSON lines, one summary per line).
 #
 # a report summary contains the report code, the specs present in raid, and the spellIDs cast.
 #
 # when scraping we'll read this cache file instead of querying the report codes from WCL.
 # not only do we save time on the query, we can also skip entire reports if the spec or
 # spells we require aren't present.
-def getJSONFromGZIPFile(FilePath):
-    f = gzip.open(FilePath, 'rb')
-    file_content = f.read()
-    return(json.loads(file_content))
-
-def getReportSummaries(options):
-    zoneID = options['zoneID']
-    reportSummariesTEMP = 'cache/' + str(zoneID) + '.json'
-    reportSummariesGZIP = 'cache/' + str(zoneID) + '.json.gz'
-    
-    if os.path.exists(reportSummariesGZIP):
-        if options['verbose']: print('Cache exists (' + reportSummariesGZIP + '), skipping...')
-        return getJSONFromGZIPFile(reportSummariesGZIP)
-
-    print('Caching report summaries for zone to temp file' + str(zoneID) + ' to ' + reportSummariesTEMP)
-
-    reportSummaries = []
-    hasMorePages = True
-    page = 0
-    totalReportsDone = 0
-    while hasMorePages:
-
-        if totalReportsDone >= MAX_REPORTS:
-            print('Maximum reports reached (' + str(MAX_REPORTS) + ')')
-            break
-            
-        page += 1
-        print('Fetching page ' + str(page) + ' for zone ' + str(zoneID))
-        zoneReports = fetchReportList(zoneID, page)
-        hasMorePages = zoneReports.get('data').get(
-            'reportData').get('reports').get('has_more_pages')
+#
+# summaries are written a page at a time and the last finished page is saved in
+# `cache/<zoneID>.cursor.json`, so an interrupted build picks up where it left off.
+# reports whose summary failed to load aren't written. their codes are kept in the
+# cursor's `failed` with the number of attempts so far, and only those are fetched
+# again: right after the build and then once per run until they load or have been
+# tried REPORT_SUMMARY_ATTEMPTS times, when they're moved to `skipped`. the cache
+# counts as complete once nothing is left in `failed`.
+# older caches (`cache/<zoneID>.json.gz`, one big JSON array) are still read.
+#
+# once a zone's summaries are complete they're converted to `cache/<zoneID>.summaries`
+# (see ReportSummaryStore), which is what scrapes actually load.
+def getCursor(FilePath):
+    if not os.path.exists(FilePath):
+        return {'page': 0, 'complete': False}
+    with open(FilePath) as f:
+        return json.load(f)
+
+def getReportSummaries(options, zoneID):
+    reportSummariesLegacy = 'cache/' + str(zoneID) + '.json.gz'
+    reportSummariesJSONL = 'cache/' + str(zoneID) + '.jsonl.gz'
+    reportSummariesStore = 'cache/' + str(zoneID) + '.summaries'
+    cursorFile = 'cache/' + str(zoneID) + '.cursor.json'
+
+    cursor = getCursor(cursorFile)
+    isComplete = not os.path.exists(cursorFile) or (cursor.get('complete') and len(cursor.get('failed', {})) == 0)
+    if not options.get('refreshCache') and isComplete and ReportSummaryStore.isCurrent(reportSummariesStore, [reportSummariesLegacy, reportSummariesJSONL, cursorFile]):
+        if options['verbose']: print('Cache exists (' + reportSummariesStore + '), skipping...')
+        return ReportSummaryStore(reportSummariesStore)
+
+    if not os.path.exists(reportSummariesJSONL) and os.path.exists(reportSummariesLegacy):
+        if not options.get('refreshCache'):
+            print('Converting ' + reportSummariesLegacy + ' to ' + reportSummariesStore)
+            ReportSummaryStore.write(reportSummariesStore, getJSONFromGZIPFile(reportSummariesLegacy))
+            return ReportSummaryStore(reportSummariesStore)
+
+        # convert so new reports can be appended
+        print('Converting ' + reportSummariesLegacy + ' to ' + reportSummariesJSONL)
+        writeValuesToJSONLFile(reportSummariesJSONL, getJSONFromGZIPFile(reportSummariesLegacy), 'wb')
+        writeCursor(cursorFile, {'page': 0, 'complete': True})
+
+    cursor = getCursor(cursorFile)
+    reportSummaries = list(getValuesFromJSONLFile(reportSummariesJSONL)) if os.path.exists(reportSummariesJSONL) else []
+    if not cursor.get('complete') or options.get('refreshCache'):
+        # a partial trailing line means the last write was interrupted, rewrite the file without it
+        if os.path.exists(reportSummariesJSONL):
+            writeValuesToJSONLFile(reportSummariesJSONL, reportSummaries, 'wb')
+
+        if cursor.get('complete'):
+            print('Refreshing report summaries for zone ' + str(zoneID) + ' in ' + reportSummariesJSONL)
+            reportSummaries += buildReportSummaries(options, zoneID, reportSummaries, reportSummariesJSONL, cursorFile, cursor, True)
+        else:
+            print('Caching report summaries for zone ' + str(zoneID) + ' to ' + reportSummariesJSONL + ' from page ' + str(cursor.get('page') + 1))
+            reportSummaries += buildReportSummaries(options, zoneID, reportSummaries, reportSummariesJSONL, cursorFile, cursor, False)
+        print('wrote ' + str(len(reportSummaries)) + ' report summaries to ' + reportSummariesJSONL)
+
+    cursor = getCursor(cursorFile)
+    if len(cursor.get('failed', {})) > 0:
+        reportSummaries += retryReportSummaries(reportSummariesJSONL, cursorFile, cursor)
+
+    print('Converting ' + reportSummariesJSONL + ' to ' + reportSummariesStore)
+    ReportSummaryStore.write(reportSummariesStore, reportSummaries)
+    return ReportSummaryStore(reportSummariesStore)
+
+# fetch one page of report codes and the summaries of the ones we don't have yet.
+# returns [hasMorePages, reportCodes, summaries], summaries being None for the
+# reports that failed to load
+def fetchReportSummaryPage(zoneID, page, knownCodes):
+    zoneReports = fetchReportList(zoneID, page)
+    hasMorePages = zoneReports.get('data').get(
+        'reportData').get('reports').get('has_more_pages')
+    with profiler.timer('jsonpath'):
         reportCodesExpr = parse('$.data.reportData.reports.data[*].code')
         reportCodes = [
-            match.value for match in reportCodesExpr.find(zoneReports)]
-
-        reportCodeCounter = 0
-        reportCodeCount = len(reportCodes)
-        for reportCode in reportCodes:
-            reportCodeCounter += 1
-            print('- caching report summary ' + str(reportCodeCounter) + ' of ' + str(reportCodeCount) + ' (' + reportCode + ')')
-
-            reportSummary = fetchReportSummary(reportCode)
-            reportSummaries.append(reportSummary)
-            totalReportsDone += 1
-
-    out_file = open(reportSummariesTEMP, "w")
-    json.dump(reportSummaries, out_file)
-    out_file.close()
-
-    print('wrote ' + str(len(reportSummaries)) + ' report codes to temp file' + reportSummariesTEMP)
-    with open(reportSummariesTEMP, 'rb') as f_in, gzip.open(reportSummariesGZIP, 'wb') as f_out:
-        f_out.writelines(f_in)
-    print('writing gzip file to ' + reportSummariesGZIP)
-
-    return getJSONFromGZIPFile(reportSummariesGZIP)
-
-def reportSummaryHasSpellForSpec(reportSummary, spec):
-    return True in [a in spec.get('spellIDs') for a in reportSummary.get('spellIDs')]
-
-def reportSummaryHasIconForSpec(reportSummary, spec):
-    for icon in reportSummary.get('icons'):
-        if icon == spec.get('icon'):
-            return True
+            match.value for match in reportCodesExpr.find(zoneReports) if match.value not in knownCodes]
+
+    return [hasMorePages, reportCodes, fetchReportSummaries(reportCodes)]
+
+# fetch pages after the `cursor`'s page, up to `workers` pages at a time, appending each page's
+# summaries and moving the cursor in page order. when refreshing, stop at the first page with
+# nothing new (reports are listed newest first). MAX_REPORTS caps the summaries a build collects,
+# cached ones included when resuming; a refresh only counts the reports it adds. reports that
+# failed to load are added to the cursor's `failed` (see retryReportSummaries), and neither
+# those nor the ones given up on count as new when they're listed again.
+def buildReportSummaries(options, zoneID, reportSummaries, reportSummariesJSONL, cursorFile, cursor, refresh):
+    workers = options.get('workers')
+    page = 0 if refresh else cursor.get('page')
+    failedCodes = dict(cursor.get('failed', {}))
+    knownCodes = set(reportSummary.get('code') for reportSummary in reportSummaries) | set(failedCodes) | set(cursor.get('skipped', []))
+    totalReportsDone = 0 if refresh else len(reportSummaries)
+    newReportSummaries = []
+    hasMorePages = True
 
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while hasMorePages:
+            if totalReportsDone >= MAX_REPORTS:
+                print('Maximum reports reached (' + str(MAX_REPORTS) + ')')
+                break
+
+            pages = range(page + 1, page + 1 + workers)
+            print('Fetching page ' + '-'.join(sorted(set([str(pages[0]), str(pages[-1])]))) + ' for zone ' + str(zoneID))
+            for hasMorePages, reportCodes, pageSummaries in executor.map(lambda p: fetchReportSummaryPage(zoneID, p, knownCodes), pages):
+                page += 1
+                failed = [reportCode for reportCode, reportSummary in zip(reportCodes, pageSummaries) if reportSummary == None and reportCode not in knownCodes]
+                pageSummaries = [reportSummary for reportSummary in pageSummaries if reportSummary != None and reportSummary.get('code') not in knownCodes]
+                pageSummaries = pageSummaries[:max(MAX_REPORTS - totalReportsDone, 0)]
+                knownCodes.update(reportSummary.get('code') for reportSummary in pageSummaries)
+                knownCodes.update(failed)
+                failedCodes.update({reportCode: 1 for reportCode in failed})
+                writeValuesToJSONLFile(reportSummariesJSONL, pageSummaries)
+                newReportSummaries += pageSummaries
+                totalReportsDone += len(pageSummaries)
+                print('- cached ' + str(len(pageSummaries)) + ' report summaries from page ' + str(page) +
+                      (', ' + str(len(failed)) + ' failed to load' if len(failed) > 0 else ''))
+
+                if refresh and len(pageSummaries) == 0 and len(failed) == 0:
+                    hasMorePages = False
+                if not hasMorePages or totalReportsDone >= MAX_REPORTS:
+                    break
+                if not refresh:
+                    writeCursor(cursorFile, dict(cursor, page=page, complete=False, failed=failedCodes))
+
+    writeCursor(cursorFile, dict(cursor, page=page, complete=True, failed=failedCodes))
+    return newReportSummaries
+
+# fetch the summaries of the reports in the `cursor`'s `failed` again, appending the
+# ones that load. the others are kept for the next run, or moved to `skipped` once
+# they've been tried REPORT_SUMMARY_ATTEMPTS times
+def retryReportSummaries(reportSummariesJSONL, cursorFile, cursor):
+    failedCodes = dict(cursor.get('failed'))
+    skippedCodes = list(cursor.get('skipped', []))
+    print('Fetching ' + str(len(failedCodes)) + ' report summaries that failed to load again')
+    reportSummaries = [reportSummary for reportSummary in fetchReportSummaries(list(failedCodes)) if reportSummary != None]
+    writeValuesToJSONLFile(reportSummariesJSONL, reportSummaries)
+    for reportSummary in reportSummaries:
+        del failedCodes[reportSummary.get('code')]
+    for reportCode in list(failedCodes):
+        failedCodes[reportCode] += 1
+        if failedCodes[reportCode] >= REPORT_SUMMARY_ATTEMPTS:
+            skippedCodes.append(reportCode)
+            del failedCodes[reportCode]
+    print('- cached ' + str(len(reportSummaries)) + ' report summaries, ' + str(len(failedCodes)) + ' left to try again next run, ' +
+          str(len(skippedCodes)) + ' given up on')
+    writeCursor(cursorFile, dict(cursor, failed=failedCodes, skipped=skippedCodes))
+    return reportSummaries
+
+# position of each magic school's table in hitTables
+hitTableIndex = {
+    MagicSchool.Arcane: 0,
+    MagicSchool.Fire: 1,
+    MagicSchool.Frost: 2,
+    MagicSchool.Nature: 3,
+    MagicSchool.Shadow: 4,
+}
+
+# stop a school at the spell cast limit or, with -p, as soon as its resistance is
+# known well enough (or it's immune)
+def reachedSpellCastLimit(options, hitTables, magicSchool):
+    hitTable = hitTables[hitTableIndex[magicSchool]]
+    if (hitTable[0] + hitTable[25] + hitTable[50] + hitTable[75] + hitTable[100]) >= options.get('spellCastLimit'):
+        return True
+    if options.get('confidenceWidth') != None:
+        width = getResConfidenceWidth(hitTable)
+        return isImmune(hitTable) or (width != None and width <= options.get('confidenceWidth'))
     return False
 
-def reachedSpellCastLimit(options, hitTables, magicSchool):
-    if magicSchool == MagicSchool.Arcane:
-        hitTable = hitTables[0]
-    elif magicSchool == MagicSchool.Fire:
-        hitTable = hitTables[1]
-    elif magicSchool == MagicSchool.Frost:
-        hitTable = hitTables[2]
-    elif magicSchool == MagicSchool.Nature:
-        hitTable = hitTables[3]
-    elif magicSchool == MagicSchool.Shadow:
-        hitTable = hitTables[4]
+def isImmune(hitTable):
+    casts = hitTable[0] + hitTable[25] + hitTable[50] + hitTable[75] + hitTable[100]
+    return casts >= IMMUNE_CASTS and casts == hitTable[0]
+
+# width of the ~95% confidence interval on the resistance getResFromPartialAverage
+# gives for a hitTable. resistance is 400 x the average fraction of damage resisted
+# per hit, so the width is 2 x z x 400 x the standard error of that average.
+# None when there aren't enough hits to tell.
+def getResConfidenceWidth(hitTable):
+    hits = hitTable[25] + hitTable[50] + hitTable[75] + hitTable[100]
+    if hits < MIN_CONFIDENCE_HITS:
+        return None
 
-    return (hitTable[0] + hitTable[25] + hitTable[50] + hitTable[75] + hitTable[100]) >= options.get('spellCastLimit')
+    resisted = {25: 0.75, 50: 0.5, 75: 0.25, 100: 0}  # a 25 means 25% of the damage got through
+    mean = sum(hitTable[x] * resisted[x] for x in resisted) / hits
+    variance = sum(hitTable[x] * (resisted[x] - mean) ** 2 for x in resisted) / (hits - 1)
+    return 2 * CONFIDENCE_Z * 400 * math.sqrt(variance / hits)
 
 
 # Returns the actual target resistance using the partial average percent.
@@ -682,58 +1139,503 @@ def getResFromPartialAverage(partialPercent, magicSchool, playerLevel:int = 60,
 ##################################################################
 # processReport
 ##################################################################
-def processReport(options, reportSummary, encounter, enemy, hitTables):
-    reportCode = reportSummary.get('code')
-    if options.get('skipCurses'):
-        enemyName = enemy.get('name') + ' (without curses)'
-    else:
-        enemyName = enemy.get('name') + ' (with curses)'
 
-    hitTableArcane = hitTables[0]
-    hitTableFire = hitTables[1]
-    hitTableFrost = hitTables[2]
-    hitTableNature = hitTables[3]
-    hitTableShadow = hitTables[4]
-
-    changed = False
+# fetch damage events for every spec that still needs casts and return the
+# hitValues keyed by enemy, magic school and curse mode, along with the casts behind them when
+# exporting a dataset (`-o`). `pendingSpecs` only holds specs the
+# report can be used for. the report is only downloaded once no matter how many
+# enemies or specs need it. this only reads shared state, so it's safe to run
+# from a worker thread. `prefetch` is the future of the batch prefetch holding
+# the report, waited for so the report isn't downloaded twice. raises FetchError
+# if the report couldn't be loaded, it's never scored as an empty report.
+def scoreReport(options, reportSummary, encounter, pendingSpecs, prefetch=None):
+    if prefetch != None:
+        with profiler.timer('prefetch wait'):
+            wait([prefetch])
+    with profiler.timer('score report'):
+        return scoreReportSpecs(options, reportSummary, encounter, pendingSpecs)
+
+# scoreReport after `delay` seconds, for a report that just failed to load
+def scoreReportLater(delay, options, reportSummary, encounter, pendingSpecs):
+    with profiler.timer('retry wait'):
+        time.sleep(delay)
+    return scoreReport(options, reportSummary, encounter, pendingSpecs)
+
+def scoreReportSpecs(options, reportSummary, encounter, pendingSpecs):
+    reportCode = reportSummary.get('code')
+    report = None
+    hitValuesByEnemy = {enemyID: {} for enemyID in pendingSpecs}
     for spec in options.get('specs'):
         magicSchool = spec.get('magicSchool')
-
-        # check the spells used and specs present in the report summary
-        # this will let us skip processing reports that don't have the
-        # data we're looking for
-        if not reportSummaryHasSpellForSpec(reportSummary, spec):
-            if options['verbose']: print('Skipping ' + magicSchool.name + '. Report missing needed spells')
+        enemyIDs = [enemyID for enemyID in pendingSpecs if spec in pendingSpecs[enemyID]]
+        if len(enemyIDs) == 0:
             continue
 
-        if not reportSummaryHasIconForSpec(reportSummary, spec):
-            if options['verbose']: print('Skipping ' + magicSchool.name + '. Report missing needed spec')
+        # fetch damage events i.e. hitValues i.e. how many full hits, misses, and partials...
+        if options['verbose']: print(' --- processing ' + magicSchool.name)
+        if report == None:
+            report = Report(options, reportCode, encounter, getReportSpecs(options, pendingSpecs))
+        for enemyID, hitValues in report.getDamageEvents(spec, enemyIDs).items():
+            hitValuesByEnemy[enemyID][magicSchool] = hitValues
+
+    return [hitValuesByEnemy, report.casts if report != None else {}]
+
+# every spec some enemy in `pendingSpecs` still needs, in options order
+def getReportSpecs(options, pendingSpecs):
+    return [spec for spec in options.get('specs') if any(spec in enemySpecs for enemySpecs in pendingSpecs.values())]
+
+# drop specs the report can't be used for (spells or spec missing from its summary)
+def getUsableSpecs(reportSummaryIndex, reportNumber, pendingSpecs):
+    usableSpecs = {}
+    for enemyID, enemySpecs in pendingSpecs.items():
+        enemySpecs = [spec for spec in enemySpecs if reportSummaryIndex.hasReport(reportSummaryIndex.getReportsForSpec(spec), reportNumber)]
+        if len(enemySpecs) > 0:
+            usableSpecs[enemyID] = enemySpecs
+    return usableSpecs
+
+# specs whose magic school hasn't reached the spell cast limit yet in some curse
+# mode, per enemy
+def getPendingSpecs(options, enemies, hitTables):
+    pendingSpecs = {}
+    for enemy in enemies:
+        enemySpecs = []
+        for spec in options.get('specs'):
+            if all(reachedSpellCastLimit(options, curseHitTables, spec.get('magicSchool')) for curseHitTables in hitTables[enemy.get('id')].values()):
+                if options['verbose']: print('Skipping ' + spec.get('magicSchool').name + ' for ' + enemy.get('name') + '. Spell cast limit or confidence reached.')
+                continue
+            enemySpecs.append(spec)
+        if len(enemySpecs) > 0:
+            pendingSpecs[enemy.get('id')] = enemySpecs
+    return pendingSpecs
+
+# add hitValues to our existing values in hitTables and return the magic schools
+# that were added. the limit is checked again here because a report may have been
+# scored while an earlier one was still in flight; dropping those keeps the
+# totals identical to a sequential run.
+def mergeHitValues(options, hitTables, hitValuesBySchool):
+    mergedSchools = []
+    for magicSchool, hitValues in hitValuesBySchool.items():
+        if reachedSpellCastLimit(options, hitTables, magicSchool):
             continue
+        hitTable = hitTables[hitTableIndex[magicSchool]]
+        for x in hitValues: hitTable[x] = hitTable[x] + hitValues[x]
+        mergedSchools.append(magicSchool)
+    return mergedSchools
+
+# Scrape progress is saved to `cache/checkpoints/<encounterID>-<enemyIDs>-<with|without>Curses.json`:
+# the hit tables so far and the last report merged into them. It's written every
+# CHECKPOINT_INTERVAL seconds (after every report when exporting casts, so the
+# dataset doesn't get duplicates on resume) and when the encounter is done. A
+# restarted scrape picks up after that report. Checkpoints from a run with other
+# schools or spell cast limit, or whose report no longer matches the summaries,
+# are ignored.
+def getCheckpointFile(options, encounter, enemies):
+    curses = '_'.join(options.get('curseModes'))
+    enemyIDs = '_'.join(str(enemy.get('id')) for enemy in enemies)
+    shard = '-shard{}of{}'.format(*options.get('shard')) if options.get('shard') else ''
+    return 'cache/checkpoints/' + str(encounter.get('id')) + '-' + enemyIDs + '-' + curses + shard + '.json'
+
+def getCheckpointSignature(options):
+    return {
+        'schools': [spec.get('magicSchool').name for spec in options.get('specs')],
+        'spellCastLimit': options.get('spellCastLimit'),
+        'confidenceWidth': options.get('confidenceWidth'),
+    }
 
-        if reachedSpellCastLimit(options, hitTables, magicSchool):
-            if options['verbose']: print('Skipping ' + magicSchool.name + '. Spell cast limit reached.')
+# the last merged report number, hitTables and result store run from a checkpoint, or None
+def getCheckpoint(options, reportSummaries, checkpointFile):
+    if options.get('ignoreCheckpoint') or not os.path.exists(checkpointFile):
+        return None
+    with open(checkpointFile) as f:
+        checkpoint = json.load(f)
+
+    reportNumber = checkpoint.get('reportNumber')
+    if checkpoint.get('signature') != getCheckpointSignature(options):
+        print('Ignoring ' + checkpointFile + ', it was written with different options')
+        return None
+    if reportNumber >= len(reportSummaries) or reportSummaries[reportNumber].get('code') != checkpoint.get('reportCode'):
+        print('Ignoring ' + checkpointFile + ', the report summaries have changed')
+        return None
+
+    # json turns our int keys into strings. checkpoints from before curse modes
+    # hold a single mode's tables
+    hitTables = {}
+    for enemyID, enemyHitTables in checkpoint.get('hitTables').items():
+        if isinstance(enemyHitTables, list):
+            enemyHitTables = {options.get('curseModes')[0]: enemyHitTables}
+        hitTables[int(enemyID)] = {curses: [{int(x): count for x, count in hitTable.items()} for hitTable in curseHitTables]
+                                   for curses, curseHitTables in enemyHitTables.items()}
+    curseSplits = {int(enemyID): enemyCurseSplits for enemyID, enemyCurseSplits in checkpoint.get('curseSplits', {}).items()}
+    return [reportNumber, hitTables, checkpoint.get('runID'), checkpoint.get('skippedReports', []), curseSplits]
+
+def writeCheckpoint(options, reportSummaries, checkpointFile, reportNumber, hitTables, runID=None, skippedReports=[], curseSplits={}):
+    os.makedirs(os.path.dirname(checkpointFile), exist_ok=True)
+    writeCursor(checkpointFile, {
+        'signature': getCheckpointSignature(options),
+        'reportNumber': reportNumber,
+        'reportCode': reportSummaries[reportNumber].get('code'),
+        'hitTables': hitTables,
+        'runID': runID,
+        'skippedReports': skippedReports,
+        'curseSplits': curseSplits,
+    })
+
+# One encounter's share of a scrape: the reports it still has to visit, the ones
+# in flight and the hit tables they're merged into. each report is scored for all
+# of `enemies` in a single pass. only reports the summary index says have the
+# spells and spec we need are visited. results are merged in report order so the
+# hit tables (and where the spell cast limit cuts off) don't depend on which
+# worker finishes first. reports up to and including `lastReportNumber` are
+# already in hitTables (see getCheckpoint), which are kept per enemy and curse
+# mode. with -w results are saved under `runID`, the run that started the scrape.
+#
+# a report the api answers with an error (deleted, private) is tried again up to
+# REPORT_LOAD_RETRIES times, REPORT_RETRY_DELAY seconds apart, and then skipped.
+# its code is kept in `skippedReports` and the checkpoint moves past it. when the
+# request itself fails (network, 5xx) the client has already retried it, so the
+# encounter stops there instead: nothing after it is merged, so the checkpoint
+# never moves past it and the next run starts with it again.
+#
+# with both curse modes each mode stops at the spell cast limit on its own, so
+# their tables can cover different reports. `curseSplits` counts hits with the
+# curse up and without over the same casts instead: only reports both modes
+# merged a school from, as {enemy gameID: {school: [cursed hits, uncursed hits]}}
+class EncounterScrape:
+    def __init__(self, options, reportSummaries, reportSummaryIndex, encounter, enemies, hitTables, checkpointFile, lastReportNumber=-1, runID=None,
+                 skippedReports=[], curseSplits={}):
+        self.options = options
+        self.reportSummaries = reportSummaries
+        self.reportSummaryIndex = reportSummaryIndex
+        self.encounter = encounter
+        self.enemies = enemies
+        self.hitTables = hitTables
+        self.checkpointFile = checkpointFile
+        self.lastReportNumber = lastReportNumber
+        self.checkpointedReportNumber = lastReportNumber
+        self.checkpointedAt = time.time()
+        self.runID = runID if runID != None else options.get('runID')
+
+        self.count = len(reportSummaries)
+        reportNumbers = reportSummaryIndex.getReportNumbers(reportSummaryIndex.getReportsForSpecs(options.get('specs')))
+        if options.get('shard'):
+            reportNumbers = [i for i in reportNumbers if isInShard(options, reportSummaries[i].get('code'))]
+        if options['verbose']: print('Skipping ' + str(self.count - len(reportNumbers)) + ' reports missing needed spells or specs')
+        self.reportNumbers = reportNumbers[bisect_right(reportNumbers, lastReportNumber):]
+        self.position = 0
+        self.prefetched = 0  # reportNumbers up to here have a prefetch submitted
+        self.prefetches = deque()  # (end of the batch in reportNumbers, future) in report order
+        self.pending = deque()  # (report number, future, usable specs) in report order
+        self.reportsDone = 0
+        self.loadFailures = {}  # report number -> times it failed to load
+        self.failedReportNumber = None  # the report the encounter stopped at
+        self.skippedReports = list(skippedReports)  # codes of reports that never loaded, checkpoints included
+        self.curseSplits = {enemy.get('id'): dict(curseSplits.get(enemy.get('id'), {})) for enemy in enemies}
+        self.changedEnemies = set()  # enemies whose tables changed since they were last displayed
+
+    def isDone(self) -> bool:
+        return self.position >= len(self.reportNumbers) and len(self.pending) == 0
+
+    def getReportsLeft(self) -> int:
+        return len(self.reportNumbers) - self.position + len(self.pending)
+
+    # where this encounter is at, for ProgressReporter
+    def getStatus(self) -> dict:
+        schools = [spec.get('magicSchool') for spec in self.options.get('specs')]
+        return {
+            'id': self.encounter.get('id'),
+            'name': self.encounter.get('name'),
+            'report': self.lastReportNumber + 1,
+            'reports': self.count,
+            'done': self.isDone(),
+            'enemies': [{
+                'id': enemy.get('id'),
+                'name': enemy.get('name'),
+                # the curse mode furthest from done
+                'casts': {magicSchool.name.lower(): min(sum(curseHitTables[hitTableIndex[magicSchool]].values()) for curseHitTables in self.hitTables[enemy.get('id')].values())
+                          for magicSchool in schools},
+            } for enemy in self.enemies],
+        }
+
+    # submit the next report that's still useful. False once there are none left
+    def submitNext(self, executor) -> bool:
+        options = self.options
+        while self.position < len(self.reportNumbers):
+            pendingSpecs = getPendingSpecs(options, self.enemies, self.hitTables)
+            if len(pendingSpecs) == 0:
+                self.position = len(self.reportNumbers)
+                break
+            reportNumber = self.reportNumbers[self.position]
+            self.position += 1
+            usableSpecs = getUsableSpecs(self.reportSummaryIndex, reportNumber, pendingSpecs)
+            if len(usableSpecs) == 0:
+                continue
+
+            # load reports a batch at a time, each with the specs it can be used for now, on
+            # the executor and a batch ahead so workers aren't left waiting for it. a batch
+            # takes two requests, the actors and then the events filtered on them. it is
+            # always queued before the reports that wait for it, so it's never stuck
+            # behind them
+            while self.prefetched < min(self.position + REPORT_BATCH_SIZE, len(self.reportNumbers)):
+                start = self.prefetched
+                self.prefetched = min(start + REPORT_BATCH_SIZE, len(self.reportNumbers))
+                reportLoads = []
+                for i in self.reportNumbers[start:self.prefetched]:
+                    specs = getReportSpecs(options, getUsableSpecs(self.reportSummaryIndex, i, pendingSpecs))
+                    if len(specs) > 0:
+                        reportLoads.append((self.reportSummaries[i].get('code'), self.encounter.get('id'), functools.partial(getReportEventRequests, self.encounter, specs)))
+                self.prefetches.append((self.prefetched, executor.submit(prefetchReportLoads, reportLoads)))
+            while self.prefetches[0][0] < self.position:
+                self.prefetches.popleft()
+
+            self.pending.append((reportNumber, executor.submit(scoreReport, options, self.reportSummaries[reportNumber], self.encounter, usableSpecs, self.prefetches[0][1]), usableSpecs))
+            return True
+        return False
+
+    # merge the finished reports at the front of the queue. `executor` runs reports
+    # that failed to load again
+    def mergeFinished(self, executor):
+        options = self.options
+        while len(self.pending) > 0 and self.pending[0][1].done():
+            reportNumber, future, usableSpecs = self.pending.popleft()
+            try:
+                hitValuesByEnemy, castsByEnemy = future.result()
+            except FetchError as e:
+                self.loadFailures[reportNumber] = self.loadFailures.get(reportNumber, 0) + 1
+                if e.transient:
+                    self.stopAt(reportNumber, e)
+                    return
+                if self.loadFailures[reportNumber] <= REPORT_LOAD_RETRIES:
+                    print('[{}] - {}, trying again in {}s'.format(self.encounter.get('name'), e, REPORT_RETRY_DELAY), datetime.datetime.now())
+                    self.pending.appendleft((reportNumber, executor.submit(scoreReportLater, REPORT_RETRY_DELAY, options, self.reportSummaries[reportNumber],
+                                                                          self.encounter, usableSpecs), usableSpecs))
+                    continue
+                print('[{}] - {}, skipping report {} of {}'.format(self.encounter.get('name'), e, reportNumber + 1, self.count), datetime.datetime.now())
+                self.skippedReports.append(self.reportSummaries[reportNumber].get('code'))
+                hitValuesByEnemy, castsByEnemy = {}, {}
+            if options['verbose']: print('[{}] - Processing report {} of {}'.format(self.encounter.get('name'), reportNumber + 1, self.count))
+            for enemy in self.enemies:
+                hitValuesBySchool = hitValuesByEnemy.get(enemy.get('id'), {})
+                mergedSchools = []
+                mergedByMode = {}
+                for curses, curseHitTables in self.hitTables[enemy.get('id')].items():
+                    mergedByMode[curses] = mergeHitValues(options, curseHitTables, {magicSchool: hitValues[curses] for magicSchool, hitValues in hitValuesBySchool.items()})
+                    for magicSchool in mergedByMode[curses]:
+                        if magicSchool not in mergedSchools:
+                            mergedSchools.append(magicSchool)
+                if len(mergedByMode) == 2:
+                    for magicSchool in mergedByMode['withCurses']:
+                        if magicSchool in mergedByMode['withoutCurses']:
+                            curseSplit = self.curseSplits[enemy.get('id')].setdefault(magicSchool.name.lower(), [0, 0])
+                            for i, curses in enumerate(('withCurses', 'withoutCurses')):
+                                curseSplit[i] += sum(hitValuesBySchool[magicSchool][curses][x] for x in (25, 50, 75, 100))
+                if len(mergedSchools) > 0:
+                    if options.get('exportFile'):
+                        castsBySchool = castsByEnemy.get(enemy.get('id'), {})
+                        writeValuesToJSONLFile(options.get('exportFile'), [cast for magicSchool in mergedSchools for cast in castsBySchool.get(magicSchool, [])])
+                    self.changedEnemies.add(enemy.get('id'))
+
+            self.lastReportNumber = reportNumber
+            self.reportsDone += 1
+            if options.get('exportFile') or time.time() - self.checkpointedAt >= CHECKPOINT_INTERVAL:
+                self.writeCheckpoint()
+
+    # give up on the encounter at a report whose request failed. reports in flight
+    # after it are dropped unmerged
+    def stopAt(self, reportNumber, error):
+        print('[{}] - {}, stopping at report {} of {}. The next run resumes from it'.format(
+            self.encounter.get('name'), error, reportNumber + 1, self.count), datetime.datetime.now())
+        self.failedReportNumber = reportNumber
+        self.position = len(self.reportNumbers)
+        for reportNumber, future, usableSpecs in self.pending:
+            future.cancel()
+        self.pending.clear()
+
+    def writeCheckpoint(self):
+        writeCheckpoint(self.options, self.reportSummaries, self.checkpointFile, self.lastReportNumber, self.hitTables, self.runID, self.skippedReports,
+                        self.curseSplits)
+        self.checkpointedAt = time.time()
+        self.checkpointedReportNumber = self.lastReportNumber
+
+    def displayChangedResults(self):
+        for enemy in self.enemies:
+            if enemy.get('id') in self.changedEnemies:
+                displayCurseModeResults(self.options, enemy, self.hitTables[enemy.get('id')], self.runID, self.curseSplits[enemy.get('id')])
+        self.changedEnemies = set()
+
+    # reports skipped at the end (spell cast limit reached) don't move the cursor,
+    # so a later run with new summaries (-u) carries on from the last merged report
+    def finish(self):
+        if self.lastReportNumber != self.checkpointedReportNumber:
+            self.writeCheckpoint()
+        for enemy in self.enemies:
+            displayCurseModeResults(self.options, enemy, self.hitTables[enemy.get('id')], self.runID, self.curseSplits[enemy.get('id')])
+        self.changedEnemies = set()
+
+def getScrapeStatus(scrapes):
+    status = {
+        'reportsDone': sum(scrape.reportsDone for scrape in scrapes),
+        'reportsFailed': sum(1 for scrape in scrapes if scrape.failedReportNumber != None),
+        'reportsSkipped': [code for scrape in scrapes for code in scrape.skippedReports],
+        'loadFailures': sum(sum(scrape.loadFailures.values()) for scrape in scrapes),
+        'reportsLeft': sum(scrape.getReportsLeft() for scrape in scrapes),
+        'encounters': [scrape.getStatus() for scrape in scrapes],
+    }
+    status.update(getAPIStats())
+    return status
+
+# Score every encounter's reports with one pool of `workers` threads. up to
+# 2 x `workers` reports are in flight at once, handed out to the encounters in
+# turn, so one encounter running out of reports (or waiting on a slow one)
+# doesn't leave workers idle. everything shares the same api client, points
+# budget and response cache. progress is printed every PROGRESS_INTERVAL seconds
+# (see ProgressReporter) and tables that changed every TABLE_INTERVAL seconds
+# and when an encounter is done.
+def processEncounters(options, scrapes):
+    workers = options.get('workers')
+    window = workers * 2 if workers > 1 else 1
+    active = list(scrapes)
+    progress = ProgressReporter(options.get('statusFile'))
+    tablesDisplayedAt = time.time()
+    if len(scrapes) > 1:
+        enemyCount = sum(len(scrape.enemies) for scrape in scrapes)
+        print('Scraping {} encounters ({} enemies) with {} workers'.format(len(scrapes), enemyCount, workers))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(active) > 0:
+            inFlight = sum(len(scrape.pending) for scrape in active)
+            submitted = True
+            while inFlight < window and submitted:
+                submitted = False
+                for scrape in active:
+                    if inFlight < window and scrape.submitNext(executor):
+                        inFlight += 1
+                        submitted = True
+
+            futures = [future for scrape in active for reportNumber, future, usableSpecs in scrape.pending]
+            if len(futures) > 0:
+                wait(futures, return_when=FIRST_COMPLETED)
+
+            for scrape in active:
+                scrape.mergeFinished(executor)
+            for scrape in [scrape for scrape in active if scrape.isDone()]:
+                scrape.finish()
+                active.remove(scrape)
+                if len(scrapes) > 1:
+                    print('[{}] - Done, {} of {} encounters left'.format(scrape.encounter.get('name'), len(active), len(scrapes)))
+
+            if progress.isDue():
+                progress.report(getScrapeStatus(scrapes))
+            if time.time() - tablesDisplayedAt >= TABLE_INTERVAL:
+                for scrape in active:
+                    scrape.displayChangedResults()
+                tablesDisplayedAt = time.time()
+
+    progress.report(getScrapeStatus(scrapes))
+
+##################################################################
+# datasets
+##################################################################
+
+# Every cast that went into the hit tables can be exported (`-o`) as gzipped JSON
+# lines, one cast per line as built by Report.getCasts. Only casts that were
+# merged are written, in merge order, so replaying a dataset with the same
+# options (`-R`) gives the same tables without touching the network. New casts
+# are appended, one gzip member per report (see writeValuesToJSONLFile).
+
+# rebuild the hit tables of every enemy in a dataset with the current rules
+# (partial ranges, hit types, curse handling, excluded auras) and display them
+def reprocessDataset(options, FilePath):
+    with open('zone.json') as zone_data:
+        zones = json.load(zone_data)
+
+    # limit to the selected targets, if any
+    if len(options['encounters']) > 0:
+        zones = [{'encounters': options['encounters']}]
+    enemies = {enemy['id']: enemy for zone in zones for encounter in zone['encounters'] for enemy in encounter['enemies']}
+    specs = {spec.get('magicSchool'): spec for spec in options.get('specs')}
+
+    hitTables = {}
+    castCount = 0
+    for cast in getValuesFromJSONLFile(FilePath):
+        castCount += 1
+        spec = specs.get(MagicSchool[cast['school'].capitalize()])
+        if spec == None or cast['enemy'] not in enemies or cast['enemy'] in options.get('ignoreEnemies'):
             continue
+        enemyHitTables = hitTables.setdefault(cast['enemy'], {curses: [{0: 0, 25: 0, 50: 0, 75: 0, 100: 0} for magicSchool in hitTableIndex]
+                                                              for curses in options.get('curseModes')})
+        for curses in options.get('curseModes'):
+            partial = classifyCast(cast, spec.get('hitTypes'), curses == 'withoutCurses')
+            if partial != None:
+                enemyHitTables[curses][hitTableIndex[spec.get('magicSchool')]][partial] += 1
+
+    if options['verbose']: print('Read ' + str(castCount) + ' casts from ' + FilePath)
+    for enemyID, enemyHitTables in hitTables.items():
+        displayCurseModeResults(options, enemies[enemyID], enemyHitTables)
+
+# Sharded scrapes (--shard i/N) split a scrape over several machines and api
+# keys. each shard only visits the reports whose code hashes to it, so the
+# shards never overlap, and saves its raw counts to its own result store.
+# --merge sums the latest counts of every shard and recomputes the resistances
+# from them. without a spell cast limit that gives the same tables one machine
+# would have. the limit (-s) applies per shard though, so N shards can merge up
+# to N times as many casts per school, taken from each shard's first reports
+# rather than the zone's.
+def isInShard(options, reportCode):
+    shard, shardCount = options.get('shard')
+    return zlib.crc32(reportCode.encode('utf-8')) % shardCount == shard - 1
+
+def getShardName(options):
+    return '{}/{}'.format(*options.get('shard')) if options.get('shard') else None
+
+def mergeShards(options, FilePaths):
+    with open('zone.json') as zone_data:
+        zones = json.load(zone_data)
 
-        # fetch damage events i.e. hitValues i.e. how many full hits, misses, and partials...
-        # add them to our existing values in hitTable
-        if options['verbose']: print(' --- processing ' + magicSchool.name)
-        hitValues = Report(options, reportCode, spec, encounter.get('id'), [enemy.get('id')]).getDamageEvents()
-        if magicSchool == MagicSchool.Arcane:
-            hitTable = hitTables[0]
-        elif magicSchool == MagicSchool.Fire:
-            hitTable = hitTables[1]
-        elif magicSchool == MagicSchool.Frost:
-            hitTable = hitTables[2]
-        elif magicSchool == MagicSchool.Nature:
-            hitTable = hitTables[3]
-        elif magicSchool == MagicSchool.Shadow:
-            hitTable = hitTables[4]
-        for x in hitValues: hitTable[x] = hitTable[x] + hitValues[x]
-        changed = True
+    # limit to the selected targets, if any
+    if len(options['encounters']) > 0:
+        zones = [{'encounters': options['encounters']}]
+    enemies = {enemy['id']: enemy for zone in zones for encounter in zone['encounters'] for enemy in encounter['enemies']}
 
-    # don't bother calculating, writing, and displaying results if nothing even changed
-    if not changed:
-        return(0)
+    shardResults = {}  # (enemyID, curses) -> {shard: hitTables}
+    for FilePath in FilePaths:
+        if not os.path.exists(FilePath):
+            print('ERROR: No result store at ' + FilePath)
+            sys.exit(4)
+        for key, shards in ResultStore(FilePath, importResults=False).getShardResults().items():
+            for shard, hitTables in shards.items():
+                if shard in shardResults.setdefault(key, {}):
+                    print('Ignoring shard ' + shard + ' of ' + str(key[0]) + ' in ' + FilePath + ', it was already merged')
+                    continue
+                shardResults[key][shard] = hitTables
+
+    for (enemyID, curses), shards in sorted(shardResults.items()):
+        if enemyID not in enemies or enemyID in options.get('ignoreEnemies'):
+            continue
+        enemyName = enemies[enemyID].get('name') + ' (' + curses + ')'
+        shardCounts = set(int(shard.split('/')[1]) for shard in shards)
+        if len(shardCounts) > 1:
+            print('WARNING: ' + enemyName + ' has shards of different splits: ' + ', '.join(sorted(shards)))
+        shardCount = max(shardCounts)
+        missing = [str(i) for i in range(1, shardCount + 1) if '{}/{}'.format(i, shardCount) not in shards]
+        if len(missing) > 0:
+            print('WARNING: ' + enemyName + ' is missing shards ' + ', '.join(missing) + ' of ' + str(shardCount))
+
+        hitTables = [{0: 0, 25: 0, 50: 0, 75: 0, 100: 0} for magicSchool in hitTableIndex]
+        for shardHitTables in shards.values():
+            for hitTable, shardHitTable in zip(hitTables, shardHitTables):
+                for x in hitTable: hitTable[x] += shardHitTable[x]
+        displayResults(options, enemies[enemyID], hitTables, curses)
+
+##################################################################
+# displayResults
+##################################################################
+# the table displayed for an enemy: resistance, casts, misses and partials per school
+def getResultsTable(enemy, hitTables):
+    hitTableArcane = hitTables[0]
+    hitTableFire = hitTables[1]
+    hitTableFrost = hitTables[2]
+    hitTableNature = hitTables[3]
+    hitTableShadow = hitTables[4]
 
     hitsArcane = hitTableArcane[25] + hitTableArcane[50] + hitTableArcane[75] + hitTableArcane[100]
     hitsFire = hitTableFire[25] + hitTableFire[50] + hitTableFire[75] + hitTableFire[100]
@@ -762,7 +1664,7 @@ def processReport(options, reportSummary, encounter, enemy, hitTables):
     if hitsArcane > 0: 
         partialAverageArcane = round(100 * (1 - hitSumArcane / hitsArcane), 2)
         resistArcane = getResFromPartialAverage(partialAverageArcane, MagicSchool.Arcane, 60, enemy.get('level'))
-    elif castsArcane >= 50 and castsArcane == missesArcane:
+    elif castsArcane >= IMMUNE_CASTS and castsArcane == missesArcane:
         partialAverageArcane = 'IMMUNE'
         resistArcane = 'IMMUNE'
     else:
@@ -772,7 +1674,7 @@ def processReport(options, reportSummary, encounter, enemy, hitTables):
     if hitsFire > 0: 
         partialAverageFire = round(100 * (1 - hitSumFire / hitsFire), 2)
         resistFire = getResFromPartialAverage(partialAverageFire, MagicSchool.Fire, 60, enemy.get('level'))
-    elif castsFire >= 50 and castsFire == missesFire:
+    elif castsFire >= IMMUNE_CASTS and castsFire == missesFire:
         partialAverageFire = 'IMMUNE'
         resistFire = 'IMMUNE'
     else:
@@ -782,7 +1684,7 @@ def processReport(options, reportSummary, encounter, enemy, hitTables):
     if hitsFrost > 0:
         partialAverageFrost = round(100 * (1 - hitSumFrost / hitsFrost), 2)
         resistFrost = getResFromPartialAverage(partialAverageFrost, MagicSchool.Frost, 60, enemy.get('level'))
-    elif castsFrost >= 50 and castsFrost == missesFrost:
+    elif castsFrost >= IMMUNE_CASTS and castsFrost == missesFrost:
         partialAverageFrost = 'IMMUNE'
         resistFrost = 'IMMUNE'
     else:
@@ -792,7 +1694,7 @@ def processReport(options, reportSummary, encounter, enemy, hitTables):
     if hitsNature > 0:
         partialAverageNature = round(100 * (1 - hitSumNature / hitsNature), 2)
         resistNature = getResFromPartialAverage(partialAverageNature, MagicSchool.Nature, 60, enemy.get('level'))
-    elif castsNature >= 50 and castsNature == missesNature:
+    elif castsNature >= IMMUNE_CASTS and castsNature == missesNature:
         partialAverageNature = 'IMMUNE'
         resistNature = 'IMMUNE'
     else:
@@ -802,7 +1704,7 @@ def processReport(options, reportSummary, encounter, enemy, hitTables):
     if hitsShadow > 0:
         partialAverageShadow = round(100 * (1 - hitSumShadow / hitsShadow), 2)
         resistShadow = getResFromPartialAverage(partialAverageShadow, MagicSchool.Shadow, 60, enemy.get('level'))
-    elif castsShadow >= 50 and castsShadow == missesShadow:
+    elif castsShadow >= IMMUNE_CASTS and castsShadow == missesShadow:
         partialAverageShadow = 'IMMUNE'
         resistShadow = 'IMMUNE'
     else:
@@ -821,61 +1723,152 @@ def processReport(options, reportSummary, encounter, enemy, hitTables):
         ('nature', resistNature, castsNature, missesNature, hitTableNature[100], hitTableNature[75], hitTableNature[50], hitTableNature[25]),
         ('shadow', resistShadow, castsShadow, missesShadow, hitTableShadow[100], hitTableShadow[75], hitTableShadow[50], hitTableShadow[25]),
     )
-    
+    return table_data
+
+# display an enemy's table for a curse mode, and with -w save its hit tables to
+# the result store under `runID` (DEFAULT: this scrape's run)
+def displayResults(options, enemy, hitTables, curses, runID=None):
+    enemyName = enemy.get('name') + (' (without curses)' if curses == 'withoutCurses' else ' (with curses)')
+    table_data = getResultsTable(enemy, hitTables)
+
     if options.get('writeResults'):
-        if options.get('skipCurses'):
-            outputFile = 'results/withoutCurses/' + str(enemy.get('id')) + '.json'
-        else:
-            outputFile = 'results/withCurses/' + str(enemy.get('id')) + '.json'
-            
-        out_file = open(outputFile, "w")
-        json.dump({
-            'enemyID': enemy.get('id'),
-            'enemyName': enemyName,
-            'tables': table_data
-        }, out_file)
-        out_file.close()
+        resultStore.putHitTables(runID if runID != None else options.get('runID'), enemy.get('id'), curses, hitTables)
 
     if options.get('quiet') == False:
         table_instance = AsciiTable(table_data, enemyName)
         print(table_instance.table)
 
+# display an enemy's table for every curse mode (`hitTables` keyed by curse mode).
+# with both, also how many hits of each school were made with its curse up
+# with both curse modes, also a breakdown of hits with each school's curse up and
+# without. `curseSplits` ({school: [cursed hits, uncursed hits]}, see
+# EncounterScrape) counts both over the same casts. without it they're taken from
+# the tables, which is only right when neither mode stopped at the spell cast
+# limit (e.g. a dataset replayed with -R)
+def displayCurseModeResults(options, enemy, hitTables, runID=None, curseSplits=None):
+    for curses in options.get('curseModes'):
+        displayResults(options, enemy, hitTables[curses], curses, runID)
+
+    if len(options.get('curseModes')) < 2 or options.get('quiet'):
+        return
+    table_data = [('school', 'curse', 'hits (curse up)', 'hits (no curse)', 'curse up')]
+    for spec in options.get('specs'):
+        index = hitTableIndex[spec.get('magicSchool')]
+        if curseSplits != None:
+            cursedHits, uncursedHits = curseSplits.get(spec.get('magicSchool').name.lower(), [0, 0])
+        else:
+            cursedHits = sum(hitTables['withCurses'][index][x] for x in (25, 50, 75, 100))
+            uncursedHits = sum(hitTables['withoutCurses'][index][x] for x in (25, 50, 75, 100))
+        table_data.append((spec.get('magicSchool').name.lower(), curseNames.get(spec.get('curseID'), '-'), cursedHits, uncursedHits,
+            str(round(100 * cursedHits / (cursedHits + uncursedHits), 1)) + '%' if cursedHits + uncursedHits > 0 else '?'))
+    print(AsciiTable(table_data, enemy.get('name') + ' (curses)').table)
+
 ##################################################################
 # MAIN
 ##################################################################
 
-#events = fetchAbilityEvents("6bN9dq2RxhVtTZfw", 667, 115, 19714, ['applybuff', 'removebuff'])
-#print(events)
-#exit(0)
-
-# parse options
-options = getOptions(sys.argv[1:]) 
-if verbose == False:
-    verbose = options.get('verbose')
-
-# read item database into jsonItems
-with open('item.json') as itemFile:
-    jsonItems = json.load(itemFile)
-
-reportSummaries = getReportSummaries(options)
-for encounter in options['encounters']:
-    if verbose: print(' - processing encounter ' + encounter.get('name') + ' (' + str(encounter.get('id')) + ')')
-    for enemy in encounter['enemies']:
-        if enemy.get('id') in options.get('ignoreEnemies'):
-            if verbose: print(' -- ignoring enemy ' + enemy.get('name') + ' (' + str(enemy.get('id')) + ')')
+if __name__ == '__main__':
+    # parse options
+    options = getOptions(sys.argv[1:]) 
+    if verbose == False:
+        verbose = options.get('verbose')
+
+    # time phases and api calls, summarized when we exit (however we exit)
+    if options.get('profile'):
+        profiler.enable(options.get('cProfileFile'))
+        def printProfile():
+            stats = getAPIStats()
+            profiler.count('api calls', stats.get('apiCalls'))
+            profiler.count('response cache hits', stats.get('cacheHits'))
+            profiler.count('response cache misses', stats.get('cacheMisses'))
+            profiler.printSummary()
+            lookups = stats.get('cacheHits') + stats.get('cacheMisses')
+            if lookups > 0:
+                print('response cache hit rate: ' + str(round(100 * stats.get('cacheHits') / lookups, 1)) + '%')
+            profiler.dumpStats()
+        atexit.register(printProfile)
+
+    # save results to the result store. merges and recomputed datasets are a new
+    # run; a scrape only adds one if it isn't resuming a run (see below)
+    if options.get('writeResults'):
+        resultStore = ResultStore()
+        if options.get('mergeFiles') or options.get('reprocessFile'):
+            options['runID'] = resultStore.addRun(' '.join(sys.argv), getShardName(options))
+
+    # combine the results of a sharded scrape
+    if options.get('mergeFiles'):
+        mergeShards(options, options.get('mergeFiles'))
+        sys.exit(0)
+
+    # recompute results from an exported dataset instead of scraping
+    if options.get('reprocessFile'):
+        reprocessDataset(options, options.get('reprocessFile'))
+        sys.exit(0)
+
+    # replay API responses from disk when we've seen the request before
+    if options.get('useCache'):
+        setResponseCache(ResponseCache())
+
+    # read item database into itemIndex
+    itemIndex = loadItemIndex('item.json')
+
+    # summaries and summary index of every zone we're scraping
+    reportSummaries = {}
+    reportSummaryIndexes = {}
+    for zoneID in dict.fromkeys(encounter.get('zoneID') for encounter in options['encounters']):
+        with profiler.timer('report summaries'):
+            reportSummaries[zoneID] = getReportSummaries(options, zoneID)
+        with profiler.timer('report summary index'):
+            reportSummaryIndexes[zoneID] = ReportSummaryIndex(reportSummaries[zoneID], options['specs'])
+
+    scrapes = []
+    for encounter in options['encounters']:
+        if verbose: print(' - processing encounter ' + encounter.get('name') + ' (' + str(encounter.get('id')) + ')')
+        enemies = []
+        hitTables = {}
+        for enemy in encounter['enemies']:
+            if enemy.get('id') in options.get('ignoreEnemies'):
+                if verbose: print(' -- ignoring enemy ' + enemy.get('name') + ' (' + str(enemy.get('id')) + ')')
+                continue
+
+            if verbose: print(' -- processing enemy ' + enemy.get('name') + ' (' + str(enemy.get('id')) + ')')
+            enemies.append(enemy)
+            hitTables[enemy.get('id')] = {curses: [
+                {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}, # arcane
+                {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}, # fire
+                {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}, # frost
+                {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}, # nature
+                {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}  # shadow
+            ] for curses in options.get('curseModes')}
+
+        if len(enemies) == 0:
             continue
 
-        if verbose: print(' -- processing enemy ' + enemy.get('name') + ' (' + str(enemy.get('id')) + ')')
-        hitTables = [
-            {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}, # arcane
-            {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}, # fire
-            {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}, # frost
-            {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}, # nature
-            {0: 0, 25: 0, 50: 0, 75: 0, 100: 0}  # shadow
-        ]
-        counter = 1
-        count = len(reportSummaries)
-        for reportSummary in reportSummaries:
-            print('[{}] - Processing report {} of {}'.format(enemy.get('name'), counter, count))
-            processReport(options, reportSummary, encounter, enemy, hitTables)
-            counter += 1
+        # pick up where an interrupted scrape of the same enemies left off
+        zoneSummaries = reportSummaries[encounter.get('zoneID')]
+        checkpointFile = getCheckpointFile(options, encounter, enemies)
+        lastReportNumber = -1
+        runID = None
+        skippedReports = []
+        curseSplits = {}
+        checkpoint = getCheckpoint(options, zoneSummaries, checkpointFile)
+        if checkpoint != None:
+            lastReportNumber, checkpointHitTables, runID, skippedReports, curseSplits = checkpoint
+            if resultStore != None and not resultStore.hasRun(runID):
+                runID = None  # written without -w, or to another result store
+            for enemyID in hitTables:
+                hitTables[enemyID].update({curses: curseHitTables for curses, curseHitTables in checkpointHitTables.get(enemyID, {}).items() if curses in hitTables[enemyID]})
+            print('[{}] - Resuming after report {} of {} from {}'.format(encounter.get('name'), lastReportNumber + 1, len(zoneSummaries), checkpointFile))
+
+        scrapes.append(EncounterScrape(options, zoneSummaries, reportSummaryIndexes[encounter.get('zoneID')],
+                                       encounter, enemies, hitTables, checkpointFile, lastReportNumber, runID, skippedReports, curseSplits))
+
+    # resumed scrapes keep saving to the run they started as, the others share a new one
+    if resultStore != None and any(scrape.runID == None for scrape in scrapes):
+        options['runID'] = resultStore.addRun(' '.join(sys.argv), getShardName(options))
+        for scrape in scrapes:
+            if scrape.runID == None:
+                scrape.runID = options['runID']
+
+    with profiler.timer('scrape'):
+        processEncounters(options, scrapes)
@@ -0,0 +1,121 @@
+import sys, math, time, threading, cProfile, pstats
+from contextlib import contextmanager
+from terminaltables import AsciiTable
+
+# Timing counters for finding out where a scrape spends its time (-P). Code
+# wraps interesting work in `profiler.timer(name)` and bumps counters with
+# `profiler.count(name, value)`; both do nothing until `enable` is called, so
+# they can stay in hot paths. Timers keep a count, a total, the max and a
+# histogram of power of two millisecond buckets to estimate percentiles from.
+# Timers running in worker threads add up, so a phase's total can be more than
+# the wall clock time.
+#
+# With a `cProfileFile` every thread is also run under cProfile and the merged
+# stats are written there when the scrape is done, for pstats, snakeviz or
+# flameprof (flamegraphs).
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.timers = {}  # name -> {'count', 'total', 'max', 'buckets': {bucket: count}}
+        self.counters = {}  # name -> value
+        self.startedAt = time.time()
+        self.cProfileFile = None
+        self.profiles = []
+        self.local = threading.local()
+
+    def enable(self, cProfileFile: str = None):
+        self.enabled = True
+        self.startedAt = time.time()
+        if cProfileFile != None:
+            self.cProfileFile = cProfileFile
+            self.enableThread()
+
+    # before python 3.12 cProfile only sees the thread that enabled it, so each
+    # worker gets its own profile. after that one profile sees every thread.
+    def enableThread(self):
+        if self.cProfileFile == None or getattr(self.local, 'profile', None) != None:
+            return
+        if len(self.profiles) > 0 and sys.version_info >= (3, 12):
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        self.local.profile = profile
+        with self.lock:
+            self.profiles.append(profile)
+
+    @contextmanager
+    def timer(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        self.enableThread()
+        startedAt = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addTime(name, time.perf_counter() - startedAt)
+
+    def addTime(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        bucket = max(math.ceil(math.log2(seconds * 1000)), 0) if seconds > 0 else 0
+        with self.lock:
+            timer = self.timers.setdefault(name, {'count': 0, 'total': 0, 'max': 0, 'buckets': {}})
+            timer['count'] += 1
+            timer['total'] += seconds
+            timer['max'] = max(timer['max'], seconds)
+            timer['buckets'][bucket] = timer['buckets'].get(bucket, 0) + 1
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # upper bound (ms) of the bucket holding the `percentile`th sample
+    @staticmethod
+    def getPercentile(timer: dict, percentile: float) -> float:
+        position = timer['count'] * percentile / 100
+        seen = 0
+        for bucket in sorted(timer['buckets']):
+            seen += timer['buckets'][bucket]
+            if seen >= position:
+                return 2 ** bucket
+        return 2 ** max(timer['buckets'])
+
+    def printSummary(self):
+        elapsed = time.time() - self.startedAt
+        with self.lock:
+            timers = dict(self.timers)
+            counters = dict(self.counters)
+
+        table_data = [('timer', 'count', 'total s', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms')]
+        for name in sorted(timers, key=lambda name: -timers[name]['total']):
+            timer = timers[name]
+            table_data.append((name, timer['count'], round(timer['total'], 2), round(timer['total'] * 1000 / timer['count'], 1),
+                '<' + str(self.getPercentile(timer, 50)), '<' + str(self.getPercentile(timer, 90)),
+                '<' + str(self.getPercentile(timer, 99)), round(timer['max'] * 1000, 1)))
+        print(AsciiTable(table_data, 'Timers ({}s wall clock)'.format(round(elapsed, 1))).table)
+
+        table_data = [('counter', 'value', 'per second')]
+        for name in sorted(counters):
+            table_data.append((name, counters[name], round(counters[name] / max(elapsed, 1e-9), 1)))
+        print(AsciiTable(table_data, 'Counters').table)
+
+        for name in sorted(timers):
+            timer = timers[name]
+            print(name + ': ' + ', '.join('<{}ms {}'.format(2 ** bucket, timer['buckets'][bucket]) for bucket in sorted(timer['buckets'])))
+
+    def dumpStats(self):
+        if self.cProfileFile == None or len(self.profiles) == 0:
+            return
+        for profile in self.profiles:
+            profile.disable()
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(self.cProfileFile)
+        print('wrote cProfile stats to ' + self.cProfileFile)
+
+profiler = Profiler()
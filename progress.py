@@ -0,0 +1,72 @@
+import time
+from datetime import datetime, timedelta
+from summaries import writeCursor
+
+PROGRESS_INTERVAL = 10  # seconds between progress lines
+
+# Rate limited progress output for a scrape. At most every `interval` seconds it
+# prints one line per encounter (report position and casts per school of each
+# enemy) and an overall line with reports/s, api calls/s and an ETA. With a
+# `statusFile` the same numbers are written there as JSON for scripts to read.
+#
+# `status` is built by the caller:
+#   {
+#       'reportsDone': reports merged so far,
+#       'reportsLeft': candidate reports not merged yet (an upper bound, schools can finish early),
+#       'reportsFailed': reports whose request failed, each stopping its encounter,
+#       'reportsSkipped': codes of reports the api answered with an error, skipped after retrying,
+#       'loadFailures': failed attempts to load a report, retries included,
+#       'apiCalls': http requests sent so far,
+#       'cacheHits': responses replayed from the response cache so far,
+#       'encounters': [{'id', 'name', 'report', 'reports', 'done', 'enemies': [{'id', 'name', 'casts': {school: casts}}]}],
+#   }
+class ProgressReporter:
+    def __init__(self, statusFile: str = None, interval: float = PROGRESS_INTERVAL):
+        self.statusFile = statusFile
+        self.interval = interval
+        self.startedAt = time.time()
+        self.reportedAt = self.startedAt
+        self.lastReportsDone = 0
+        self.lastAPICalls = 0
+
+    def isDue(self) -> bool:
+        return time.time() - self.reportedAt >= self.interval
+
+    def report(self, status: dict):
+        now = time.time()
+        elapsed = max(now - self.reportedAt, 1e-9)
+
+        # rates since the last line, the ETA from the average over the whole run
+        reportsPerSecond = (status.get('reportsDone') - self.lastReportsDone) / elapsed
+        apiCallsPerSecond = (status.get('apiCalls') - self.lastAPICalls) / elapsed
+        averageRate = status.get('reportsDone') / max(now - self.startedAt, 1e-9)
+        eta = status.get('reportsLeft') / averageRate if averageRate > 0 else None
+
+        self.reportedAt = now
+        self.lastReportsDone = status.get('reportsDone')
+        self.lastAPICalls = status.get('apiCalls')
+
+        for encounter in status.get('encounters'):
+            if encounter.get('done'):
+                continue
+            casts = '; '.join(enemy.get('name') + ': ' + ', '.join('{} {}'.format(school, count) for school, count in enemy.get('casts').items())
+                              for enemy in encounter.get('enemies'))
+            print('[{}] - Processing report {} of {} | {}'.format(encounter.get('name'), encounter.get('report'), encounter.get('reports'), casts))
+        print('Progress: {} reports, {} reports/s, {} api calls/s, {} cache hits, {} reports left, ETA {}'.format(
+            status.get('reportsDone'), round(reportsPerSecond, 2), round(apiCallsPerSecond, 2), status.get('cacheHits'),
+            status.get('reportsLeft'), timedelta(seconds=round(eta)) if eta != None else '?'), datetime.now())
+        if status.get('loadFailures'):
+            print('Failed report loads: {} ({} encounters stopped, {} reports skipped)'.format(
+                status.get('loadFailures'), status.get('reportsFailed'), len(status.get('reportsSkipped') or [])))
+
+        if self.statusFile != None:
+            status = dict(status)
+            status.update({
+                'time': datetime.now().isoformat(),
+                'elapsed': round(now - self.startedAt, 1),
+                'reportsPerSecond': round(reportsPerSecond, 3),
+                'apiCallsPerSecond': round(apiCallsPerSecond, 3),
+                'eta': round(eta) if eta != None else None,
+            })
+            # readers never see a half written status
+            writeCursor(self.statusFile, status, indent=2)
@@ -0,0 +1,97 @@
+import os, sqlite3, threading, hashlib, zlib, json, time
+from profiler import profiler
+
+RESPONSE_CACHE_FILE = 'cache/responses.sqlite'
+RESPONSE_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024  # 4GB
+
+# Persistent cache of API responses. Warcraft Logs reports never change once
+# uploaded, so a response can be replayed forever. Entries are keyed by a hash
+# of the request (endpoint + query) and stored zlib compressed in SQLite. When
+# the cache grows past `maxBytes` the least recently used entries are dropped.
+#
+# One connection is shared between threads (guarded by a lock) and WAL mode
+# lets several scraper processes use the same file.
+class ResponseCache:
+    def __init__(self, path: str = RESPONSE_CACHE_FILE, maxBytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            )''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.size = self.getSize()
+
+    @staticmethod
+    def getKey(*parts) -> str:
+        return hashlib.sha256('\n'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def getSize(self) -> int:
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, key: str):
+        with profiler.timer('response cache get'):
+            return self.getValue(key)
+
+    def getValue(self, key: str):
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM responses WHERE key = ?', (key,)).fetchone()
+            if row == None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+        return json.loads(zlib.decompress(row[0]))
+
+    def contains(self, key: str) -> bool:
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM responses WHERE key = ?', (key,)).fetchone() != None
+
+    def put(self, key: str, value):
+        with profiler.timer('response cache put'):
+            self.putValue(key, value)
+
+    def putValue(self, key: str, value):
+        blob = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+        with self.lock:
+            row = self.connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses (key, value, size, accessed) VALUES (?, ?, ?, ?)',
+                (key, blob, len(blob), time.time()))
+            self.size += len(blob) - (row[0] if row else 0)
+            if self.size > self.maxBytes:
+                self.evict()
+
+    # drop least recently used entries until we're back under 90% of maxBytes.
+    # other processes may have written to the file too, so recount first.
+    def evict(self):
+        self.size = self.getSize()
+        target = self.maxBytes * 0.9
+        while self.size > target:
+            rows = self.connection.execute(
+                'SELECT key, size FROM responses ORDER BY accessed LIMIT 1000').fetchall()
+            if len(rows) == 0:
+                break
+            self.connection.execute('BEGIN')
+            for key, size in rows:
+                self.connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.size -= size
+                if self.size <= target:
+                    break
+            self.connection.execute('COMMIT')
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
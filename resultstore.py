@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import os, sys, glob, json, time, sqlite3, threading
+
+RESULT_STORE_FILE = 'results/results.sqlite'
+CURSE_MODES = ('withCurses', 'withoutCurses')
+SCHOOLS = ('arcane', 'fire', 'frost', 'nature', 'shadow')  # hitTables order
+
+# Results of every scrape written with -w. Rows hold the raw hit table of one
+# school (casts per partial bucket, hitTable keys are % of damage done) per
+# enemy, curse mode and run, so resistances are always recomputed from counts
+# and runs can be compared or combined. A run is one scrape command; a scrape
+# resumed from a checkpoint keeps writing to the run that started it. Runs of a
+# sharded scrape (--shard i/N) remember their shard so stores from several
+# machines can be merged (--merge).
+#
+# All of an enemy's schools are replaced in one transaction, so readers never
+# see half an update, and WAL mode lets several scraper processes write while
+# -a/-r read. One connection is shared between threads (guarded by a lock).
+# A `readOnly` store must already exist and is never changed.
+class ResultStore:
+    def __init__(self, path: str = RESULT_STORE_FILE, importResults: bool = True, readOnly: bool = False):
+        self.path = path
+        self.lock = threading.Lock()
+        if readOnly:
+            self.connection = sqlite3.connect('file:' + path + '?mode=ro', uri=True, timeout=60, check_same_thread=False, isolation_level=None)
+            return
+
+        created = not os.path.exists(path)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started REAL NOT NULL,
+                command TEXT NOT NULL,
+                shard TEXT
+            )''')
+        if 'shard' not in [column[1] for column in self.connection.execute('PRAGMA table_info(runs)')]:
+            self.connection.execute('ALTER TABLE runs ADD COLUMN shard TEXT')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS results (
+                enemyID INTEGER NOT NULL,
+                curses TEXT NOT NULL,
+                runID INTEGER NOT NULL,
+                school TEXT NOT NULL,
+                hit0 INTEGER NOT NULL,
+                hit25 INTEGER NOT NULL,
+                hit50 INTEGER NOT NULL,
+                hit75 INTEGER NOT NULL,
+                hit100 INTEGER NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (enemyID, curses, runID, school)
+            )''')
+
+        # results from before the store are imported once, as their own run
+        if created and importResults:
+            self.importJSONResults(os.path.dirname(path) or '.')
+
+    # `shard` is 'i/N' for a sharded scrape
+    def addRun(self, command: str, shard: str = None) -> int:
+        with self.lock:
+            return self.connection.execute('INSERT INTO runs (started, command, shard) VALUES (?, ?, ?)', (time.time(), command, shard)).lastrowid
+
+    def hasRun(self, runID: int) -> bool:
+        with self.lock:
+            return runID != None and self.connection.execute('SELECT 1 FROM runs WHERE id = ?', (runID,)).fetchone() != None
+
+    # replace a run's hit tables for an enemy
+    def putHitTables(self, runID: int, enemyID: int, curses: str, hitTables: list):
+        now = time.time()
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                for school, hitTable in zip(SCHOOLS, hitTables):
+                    self.connection.execute(
+                        'INSERT OR REPLACE INTO results (enemyID, curses, runID, school, hit0, hit25, hit50, hit75, hit100, updated) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (enemyID, curses, runID, school, hitTable[0], hitTable[25], hitTable[50], hitTable[75], hitTable[100], now))
+                self.connection.execute('COMMIT')
+            except:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    @staticmethod
+    def getHitTables(rows) -> list:
+        hitTables = {school: {0: 0, 25: 0, 50: 0, 75: 0, 100: 0} for school in SCHOOLS}
+        for school, hit0, hit25, hit50, hit75, hit100 in rows:
+            hitTables[school] = {0: hit0, 25: hit25, 50: hit50, 75: hit75, 100: hit100}
+        return [hitTables[school] for school in SCHOOLS]
+
+    def getResults(self, enemyID: int, curses: str, runID: int) -> list:
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT school, hit0, hit25, hit50, hit75, hit100 FROM results WHERE enemyID = ? AND curses = ? AND runID = ?',
+                (enemyID, curses, runID)).fetchall()
+        return self.getHitTables(rows)
+
+    # {(enemyID, curses): (runID, hitTables)} of the most recently updated unsharded run per enemy and curse mode
+    def getLatestResults(self, enemyID: int = None) -> dict:
+        with self.lock:
+            # sqlite takes runID from the row holding MAX(updated). a shard only
+            # covers part of the reports, so its runs count once merged (--merge)
+            latest = self.connection.execute(
+                'SELECT results.enemyID, results.curses, results.runID, MAX(results.updated)'
+                ' FROM results LEFT JOIN runs ON runs.id = results.runID WHERE runs.shard IS NULL' +
+                (' AND results.enemyID = ?' if enemyID != None else '') +
+                ' GROUP BY results.enemyID, results.curses', (enemyID,) if enemyID != None else ()).fetchall()
+            rows = {}
+            for resultEnemyID, curses, runID, updated in latest:
+                rows[(resultEnemyID, curses)] = (runID, self.connection.execute(
+                    'SELECT school, hit0, hit25, hit50, hit75, hit100 FROM results WHERE enemyID = ? AND curses = ? AND runID = ?',
+                    (resultEnemyID, curses, runID)).fetchall())
+        return {key: (runID, self.getHitTables(schoolRows)) for key, (runID, schoolRows) in rows.items()}
+
+    # {(enemyID, curses): {shard: hitTables}} of the most recently updated run of every shard
+    def getShardResults(self) -> dict:
+        with self.lock:
+            latest = self.connection.execute('''
+                SELECT results.enemyID, results.curses, runs.shard, results.runID, MAX(results.updated)
+                FROM results JOIN runs ON runs.id = results.runID
+                WHERE runs.shard IS NOT NULL
+                GROUP BY results.enemyID, results.curses, runs.shard''').fetchall()
+            rows = {}
+            for enemyID, curses, shard, runID, updated in latest:
+                rows.setdefault((enemyID, curses), {})[shard] = self.connection.execute(
+                    'SELECT school, hit0, hit25, hit50, hit75, hit100 FROM results WHERE enemyID = ? AND curses = ? AND runID = ?',
+                    (enemyID, curses, runID)).fetchall()
+        return {key: {shard: self.getHitTables(schoolRows) for shard, schoolRows in shards.items()} for key, shards in rows.items()}
+
+    # every run with results for `enemyID`, newest first
+    def getRuns(self, enemyID: int) -> list:
+        with self.lock:
+            rows = self.connection.execute('''
+                SELECT results.runID, results.curses, runs.started, runs.command, runs.shard, MAX(results.updated),
+                       SUM(results.hit0 + results.hit25 + results.hit50 + results.hit75 + results.hit100)
+                FROM results LEFT JOIN runs ON runs.id = results.runID
+                WHERE results.enemyID = ?
+                GROUP BY results.runID, results.curses
+                ORDER BY MAX(results.updated) DESC''', (enemyID,)).fetchall()
+        return [{'runID': runID, 'curses': curses, 'started': started, 'command': command, 'shard': shard, 'updated': updated, 'casts': casts}
+                for runID, curses, started, command, shard, updated, casts in rows]
+
+    # import results/<curses>/<enemyID>.json tables written before the store existed
+    def importJSONResults(self, resultsDir: str) -> int:
+        files = sorted(glob.glob(os.path.join(resultsDir, '*', '*.json')))
+        files = [FilePath for FilePath in files if os.path.basename(os.path.dirname(FilePath)) in CURSE_MODES]
+        if len(files) == 0:
+            return 0
+        runID = self.addRun('import ' + os.path.join(resultsDir, '*', '*.json'))
+        for FilePath in files:
+            with open(FilePath) as f:
+                resultsJson = json.load(f)
+            # rows are school, res, #, miss, full, 25%, 50%, 75% with 25 and 75 swapped (% resisted)
+            hitTables = [{0: row[3], 100: row[4], 75: row[5], 50: row[6], 25: row[7]} for row in resultsJson.get('tables')[1:6]]
+            self.putHitTables(runID, resultsJson.get('enemyID'), os.path.basename(os.path.dirname(FilePath)), hitTables)
+        return len(files)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+# import per-enemy JSON results into a store by hand, e.g.
+#   ./resultstore.py results results/results.sqlite
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: resultstore.py <resultsDir> <results.sqlite>')
+        sys.exit(1)
+
+    resultStore = ResultStore(sys.argv[2], importResults=False)
+    print('imported ' + str(resultStore.importJSONResults(sys.argv[1])) + ' result files to ' + sys.argv[2])
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+import os, sys, gzip, json, mmap, struct
+from array import array
+from bisect import bisect_right
+
+def getJSONFromGZIPFile(FilePath):
+    f = gzip.open(FilePath, 'rb')
+    file_content = f.read()
+    return(json.loads(file_content))
+
+# Gzipped JSON lines files (report summaries, exported casts): one value per
+# line, appended a batch at a time as one gzip member each. values are streamed
+# back, stopping at the first incomplete line (e.g. a write that was cut off by
+# a crash)
+def getValuesFromJSONLFile(FilePath):
+    try:
+        with gzip.open(FilePath, 'rt') as f:
+            for line in f:
+                try:
+                    value = json.loads(line)
+                except ValueError:
+                    break
+                yield value
+    except (EOFError, OSError):
+        pass
+
+# append `values`, or with mode 'wb' replace the file with them
+def writeValuesToJSONLFile(FilePath, values, mode='ab'):
+    if len(values) == 0 and mode == 'ab':
+        return
+    with gzip.open(FilePath, mode) as f:
+        f.write(''.join(json.dumps(value, separators=(',', ':')) + '\n' for value in values).encode('utf-8'))
+
+# write to a temp file and rename it so a crash never leaves a half written file
+# (cursors, checkpoints, the progress status file)
+def writeCursor(FilePath, cursor, indent=None):
+    with open(FilePath + '.tmp', 'w') as f:
+        json.dump(cursor, f, indent=indent)
+    os.replace(FilePath + '.tmp', FilePath)
+
+# Compact, memory-mapped copy of a zone's report summaries. Spell ids and icons
+# are interned into small tables and every report's spells/icons are stored as
+# uint16 indexes into them, column by column:
+#
+#   header
+#   codes          count x codeWidth bytes, zero padded
+#   spellOffsets   (count + 1) x uint32, report i's spells are spellRefs[spellOffsets[i]:spellOffsets[i + 1]]
+#   spellRefs      uint16 indexes into spellTable
+#   iconOffsets    (count + 1) x uint32
+#   iconRefs       uint16 indexes into iconTable
+#   spellTable     int32 spell ids
+#   iconTable      JSON list of icon names
+#
+# Everything is little endian. Opening the file only reads the header and the two
+# small tables, the rest is paged in by the OS as it's used, so memory stays flat
+# no matter how many reports a zone has. Summaries are handed out as dicts on
+# demand so the store can be used anywhere a list of summaries is.
+SUMMARY_STORE_MAGIC = b'PSUM'
+SUMMARY_STORE_VERSION = 1
+summaryStoreHeader = struct.Struct('<4sIIIIIIII')  # magic, version, count, codeWidth, spells, icons, spellRefs, iconRefs, iconTable bytes
+
+class ReportSummaryStore:
+    def __init__(self, FilePath: str):
+        self.file = open(FilePath, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.codeWidth, spellCount, iconCount, spellRefCount, iconRefCount, iconTableBytes = \
+            summaryStoreHeader.unpack_from(self.mm, 0)
+        if magic != SUMMARY_STORE_MAGIC or version != SUMMARY_STORE_VERSION:
+            raise ValueError('Not a report summary store (or an old version): ' + FilePath)
+
+        view = memoryview(self.mm)
+        position = summaryStoreHeader.size
+        self.codesStart = position
+        position = self.align(position + self.count * self.codeWidth)
+        self.spellOffsets, position = self.getColumn(view, position, 'I', self.count + 1)
+        self.spellRefsStart = position
+        self.spellRefs, position = self.getColumn(view, position, 'H', spellRefCount)
+        self.iconOffsets, position = self.getColumn(view, position, 'I', self.count + 1)
+        self.iconRefsStart = position
+        self.iconRefs, position = self.getColumn(view, position, 'H', iconRefCount)
+        spellTable, position = self.getColumn(view, position, 'i', spellCount)
+        self.spellTable = list(spellTable)
+        self.iconTable = json.loads(bytes(view[position:position + iconTableBytes]).decode('utf-8'))
+        self.spellIndex = {spellID: i for i, spellID in enumerate(self.spellTable)}
+        self.iconIndex = {icon: i for i, icon in enumerate(self.iconTable)}
+
+    @staticmethod
+    def align(position: int) -> int:
+        return (position + 3) & ~3
+
+    # a typed view of `length` items at `position`, and where the next column starts
+    @staticmethod
+    def getColumn(view, position: int, typecode: str, length: int):
+        size = array(typecode).itemsize * length
+        if sys.byteorder == 'little':
+            column = view[position:position + size].cast(typecode)
+        else:
+            column = array(typecode, bytes(view[position:position + size]))
+            column.byteswap()
+        return column, ReportSummaryStore.align(position + size)
+
+    # true if the store exists and is newer than every source it was built from
+    @staticmethod
+    def isCurrent(FilePath: str, sources: list) -> bool:
+        if not os.path.exists(FilePath):
+            return False
+        modified = os.path.getmtime(FilePath)
+        return all(not os.path.exists(source) or os.path.getmtime(source) <= modified for source in sources)
+
+    @staticmethod
+    def write(FilePath: str, reportSummaries):
+        spellTable, spellIndex = [], {}
+        iconTable, iconIndex = [], {}
+        spellOffsets, spellRefs = array('I', [0]), array('H')
+        iconOffsets, iconRefs = array('I', [0]), array('H')
+        codes = []
+        for reportSummary in reportSummaries:
+            codes.append(reportSummary.get('code').encode('ascii'))
+            for spellID in reportSummary.get('spellIDs'):
+                if spellID not in spellIndex:
+                    spellIndex[spellID] = len(spellTable)
+                    spellTable.append(spellID)
+                spellRefs.append(spellIndex[spellID])
+            spellOffsets.append(len(spellRefs))
+            for icon in reportSummary.get('icons'):
+                if icon not in iconIndex:
+                    iconIndex[icon] = len(iconTable)
+                    iconTable.append(icon)
+                iconRefs.append(iconIndex[icon])
+            iconOffsets.append(len(iconRefs))
+
+        if len(spellTable) > 0xFFFF or len(iconTable) > 0xFFFF:
+            raise ValueError('Too many distinct spells or icons for a report summary store')
+
+        codeWidth = max([len(code) for code in codes] + [1])
+        iconTableJSON = json.dumps(iconTable).encode('utf-8')
+
+        # write to a temp file and rename it so readers never see a half written store
+        with open(FilePath + '.tmp', 'wb') as f:
+            def writeColumn(data):
+                f.write(data)
+                f.write(bytes(ReportSummaryStore.align(f.tell()) - f.tell()))
+
+            f.write(summaryStoreHeader.pack(SUMMARY_STORE_MAGIC, SUMMARY_STORE_VERSION, len(codes), codeWidth,
+                len(spellTable), len(iconTable), len(spellRefs), len(iconRefs), len(iconTableJSON)))
+            writeColumn(b''.join(code.ljust(codeWidth, b'\0') for code in codes))
+            for column in (spellOffsets, spellRefs, iconOffsets, iconRefs, array('i', spellTable)):
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                writeColumn(column.tobytes())
+            f.write(iconTableJSON)
+        os.replace(FilePath + '.tmp', FilePath)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def __getitem__(self, i: int) -> dict:
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError('report summary index out of range')
+        return {
+            'code': self.getCode(i),
+            'spellIDs': [self.spellTable[ref] for ref in self.spellRefs[self.spellOffsets[i]:self.spellOffsets[i + 1]]],
+            'icons': [self.iconTable[ref] for ref in self.iconRefs[self.iconOffsets[i]:self.iconOffsets[i + 1]]],
+        }
+
+    def getCode(self, i: int) -> str:
+        start = self.codesStart + i * self.codeWidth
+        return self.mm[start:start + self.codeWidth].rstrip(b'\0').decode('ascii')
+
+    # report numbers whose refs column contains `ref`, found by searching the
+    # mapped bytes directly instead of decoding every report
+    def findReports(self, refsStart: int, refCount: int, offsets, ref: int) -> list:
+        pattern = struct.pack('<H', ref)
+        end = refsStart + refCount * 2
+        reports = []
+        position = self.mm.find(pattern, refsStart, end)
+        while position != -1:
+            if (position - refsStart) % 2 == 1:
+                position = self.mm.find(pattern, position + 1, end)
+                continue
+            report = bisect_right(offsets, (position - refsStart) // 2) - 1
+            if len(reports) == 0 or reports[-1] != report:
+                reports.append(report)
+            position = self.mm.find(pattern, position + 2, end)
+        return reports
+
+    def getReportsWithSpell(self, spellID: int) -> list:
+        if spellID not in self.spellIndex:
+            return []
+        return self.findReports(self.spellRefsStart, len(self.spellRefs), self.spellOffsets, self.spellIndex[spellID])
+
+    def getReportsWithIcon(self, icon: str) -> list:
+        if icon not in self.iconIndex:
+            return []
+        return self.findReports(self.iconRefsStart, len(self.iconRefs), self.iconOffsets, self.iconIndex[icon])
+
+# Inverted index over a zone's report summaries. For every spell and spec icon
+# we care about it keeps a bitset (a python int, bit i = report i) of the
+# reports that have it, so the reports a spec can use are found with a few
+# ORs and ANDs instead of scanning every summary.
+class ReportSummaryIndex:
+    def __init__(self, reportSummaries, specs: list):
+        self.count = len(reportSummaries)
+        spellIDs = set(spellID for spec in specs for spellID in spec.get('spellIDs'))
+        icons = set(spec.get('icon') for spec in specs)
+
+        if isinstance(reportSummaries, ReportSummaryStore):
+            spellReports = {spellID: reportSummaries.getReportsWithSpell(spellID) for spellID in spellIDs}
+            iconReports = {icon: reportSummaries.getReportsWithIcon(icon) for icon in icons}
+        else:
+            spellReports = {spellID: [] for spellID in spellIDs}
+            iconReports = {icon: [] for icon in icons}
+            for i, reportSummary in enumerate(reportSummaries):
+                for spellID in reportSummary.get('spellIDs'):
+                    if spellID in spellReports:
+                        spellReports[spellID].append(i)
+                for icon in reportSummary.get('icons'):
+                    if icon in iconReports:
+                        iconReports[icon].append(i)
+
+        self.spellReports = {spellID: self.getBitset(reports) for spellID, reports in spellReports.items()}
+        self.iconReports = {icon: self.getBitset(reports) for icon, reports in iconReports.items()}
+        self.specReports = {}
+
+    def getBitset(self, reports: list) -> int:
+        bitmap = bytearray((self.count + 7) // 8)
+        for i in reports:
+            bitmap[i >> 3] |= 1 << (i & 7)
+        return int.from_bytes(bitmap, 'little')
+
+    # reports with at least one of the spec's spells and the spec's icon
+    def getReportsForSpec(self, spec: dict) -> int:
+        key = (spec.get('icon'), tuple(spec.get('spellIDs')))
+        if key not in self.specReports:
+            reports = 0
+            for spellID in spec.get('spellIDs'):
+                reports |= self.spellReports.get(spellID, 0)
+            self.specReports[key] = reports & self.iconReports.get(spec.get('icon'), 0)
+        return self.specReports[key]
+
+    def getReportsForSpecs(self, specs: list) -> int:
+        reports = 0
+        for spec in specs:
+            reports |= self.getReportsForSpec(spec)
+        return reports
+
+    def hasReport(self, reports: int, i: int) -> bool:
+        return (reports >> i) & 1 == 1
+
+    # positions of the set bits, in order
+    def getReportNumbers(self, reports: int) -> list:
+        bitmap = reports.to_bytes((self.count + 7) // 8, 'little')
+        return [i * 8 + bit for i, byte in enumerate(bitmap) if byte for bit in range(8) if byte >> bit & 1]
+
+
+# convert a zone's .json.gz or .jsonl.gz summaries to a ReportSummaryStore, e.g.
+#   ./summaries.py cache/1004.json.gz cache/1004.summaries
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: summaries.py <summaries.json.gz | summaries.jsonl.gz> <output.summaries>')
+        sys.exit(1)
+
+    if sys.argv[1].endswith('.jsonl.gz'):
+        reportSummaries = list(getValuesFromJSONLFile(sys.argv[1]))
+    else:
+        reportSummaries = getJSONFromGZIPFile(sys.argv[1])
+    ReportSummaryStore.write(sys.argv[2], reportSummaries)
+    print('wrote ' + str(len(reportSummaries)) + ' report summaries to ' + sys.argv[2])
@@ -0,0 +1,93 @@
+import os, sys, random
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+from main import DebuffEvent, DebuffTimeline
+
+# the modifier walking `debuffEvents` in order and taking the first window that
+# contains `time`, which is what DebuffTimeline replaces
+def getModByScan(debuffEvents, time):
+    for debuffEvent in debuffEvents:
+        if debuffEvent.sTime <= time <= debuffEvent.eTime:
+            return debuffEvent.mod
+    return None
+
+# overlapping windows of a few different modifiers, with some empty (eTime < sTime) ones
+def getRandomDebuffEvents(rng, count, duration):
+    debuffEvents = []
+    for _ in range(count):
+        sTime = rng.randrange(duration)
+        debuffEvents.append(DebuffEvent(sTime, sTime + rng.randrange(-50, duration // 4), rng.choice([1.03, 1.06, 1.1, 1.15])))
+    return debuffEvents
+
+@pytest.mark.parametrize('seed', range(50))
+def test_timeline_matches_first_match_scan(seed):
+    rng = random.Random(seed)
+    debuffEvents = getRandomDebuffEvents(rng, rng.randrange(12), 2000)
+    timeline = DebuffTimeline(debuffEvents)
+
+    # every window edge and its neighbours, plus random times (some outside every window)
+    times = [time for e in debuffEvents for edge in (e.sTime, e.eTime) for time in (edge - 1, edge, edge + 1)]
+    times += [rng.randrange(-100, 2500) for _ in range(200)]
+    for time in times:
+        assert timeline.getMod(time) == getModByScan(debuffEvents, time)
+
+    if main.np != None:
+        mods = timeline.getMods(main.np.array(times, dtype=main.np.int64))
+        assert [None if main.np.isnan(mod) else mod for mod in mods.tolist()] == [getModByScan(debuffEvents, time) for time in times]
+
+FIRE = {
+    'name': 'Fire',
+    'magicSchool': main.MagicSchool.Fire,
+    'hitTypes': {1: 1, 2: 1.5, 14: 0, 16: 1, 17: 1.5},
+}
+DEADEN_MAGIC = {'type': 'buff', 'id': 19714}
+
+# a Report of one target with everything getCasts and getHitDataVectorized read,
+# without loading anything from the api
+def getRandomReport(rng, duration):
+    report = main.Report.__new__(main.Report)
+    report.options = {'curseModes': list(main.CURSE_MODES)}
+    report.reportCode = 'test'
+    report.encounterID = 1
+    report.excludeAuras = {12264: [DEADEN_MAGIC]}
+    report.auraEvents = {}
+    report.events = {'buff19714': []}
+    for sTime in sorted(rng.sample(range(duration), 6)):
+        report.events['buff19714'].append({'type': rng.choice(['applybuff', 'removebuff']), 'targetID': 5, 'timestamp': sTime})
+    return report
+
+# damage events of three players (one with spell penetration gear) with every hit
+# type, missing fields, and amounts near and between the partial buckets
+def getRandomDamageEvents(rng, count, duration):
+    events = []
+    for _ in range(count):
+        event = {'sourceID': rng.choice([1, 2, 3]), 'targetID': 5, 'timestamp': rng.randrange(duration), 'abilityGameID': 10151,
+                 'hitType': rng.choice([1, 2, 14, 16, 17, None])}
+        if rng.random() < 0.95:
+            event['unmitigatedAmount'] = rng.randrange(0, 3000)
+        multiplier = FIRE['hitTypes'].get(event['hitType'], 1) * rng.choice([1, 1.03, 1.1, 1.133, 1.15, 1.265])
+        fraction = rng.choice([0.25, 0.5, 0.75, 1.0]) + rng.uniform(-0.04, 0.04) if rng.random() < 0.8 else rng.random()
+        event['amount'] = None if rng.random() < 0.02 else int(event.get('unmitigatedAmount', 0) * multiplier * fraction)
+        events.append(event)
+    return events
+
+@pytest.mark.skipif(main.np == None, reason='numpy is not installed')
+@pytest.mark.parametrize('seed', range(20))
+def test_vectorized_classification_matches_classify_cast(seed, monkeypatch):
+    rng = random.Random(seed)
+    duration = 100000
+    monkeypatch.setattr(main, 'itemIndex', {1: {'spellPenetration': 10}}, raising=False)
+    actors = {actorID: main.FriendlyActor({'id': actorID, 'name': 'Player' + str(actorID), 'gear': gear})
+              for actorID, gear in ((1, [{'id': 1}]), (2, []), (3, [{'id': 2}]))}
+    curseTimeline = DebuffTimeline(getRandomDebuffEvents(rng, 4, duration))
+    modifierTimeline = DebuffTimeline(getRandomDebuffEvents(rng, 8, duration))
+    report = getRandomReport(rng, duration)
+    events = getRandomDamageEvents(rng, 2000, duration)
+
+    casts = report.getCasts(FIRE, 12264, 5, events, actors, curseTimeline, modifierTimeline)
+    hitData = report.getHitData(FIRE, casts)
+    assert report.getHitDataVectorized(FIRE, 12264, 5, events, actors, curseTimeline, modifierTimeline) == hitData
+    # the generated events have to reach the partial buckets for the comparison to mean anything
+    assert sum(hitData[curses][partial] for curses in main.CURSE_MODES for partial in (25, 50, 75, 100)) > 0
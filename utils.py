@@ -1,7 +1,15 @@
-import sys, os, enum, time, json, requests
-from jsonpath_ng import jsonpath, parse
+import enum, threading
+from jsonpath_ng import parse
 from datetime import datetime
 from variables import apiUrl, headers
+from client import APIClient
+from profiler import profiler
+
+# optional ResponseCache shared by every fetch (see `setResponseCache`)
+responseCache = None
+
+# pooled, retrying http client shared by every fetch
+client = APIClient()
 
 # these values match the `type` field in WCL's `abilities()`
 class MagicSchool(enum.Enum):
@@ -14,125 +22,369 @@ class MagicSchool(enum.Enum):
     Shadow = 32
     Arcane = 64
 
-def fetchGraphQL(query):
-    try:
-        response = requests.post(
-            apiUrl, json={'query': query}, headers=headers, timeout=60).json()
-        if response.get('errors'):
-            return None
-        else:
+# a request the api didn't answer. `transient` if the request itself failed
+# (network, 5xx after the client's retries) and asking again later may work, not
+# if the api answered with an error, e.g. for a deleted or private report
+class FetchError(Exception):
+    def __init__(self, message: str, transient: bool = False):
+        super().__init__(message)
+        self.transient = transient
+
+def setResponseCache(cache):
+    global responseCache
+    responseCache = cache
+
+# http requests sent and response cache hits so far, for progress output
+def getAPIStats() -> dict:
+    return {
+        'apiCalls': client.requestCount,
+        'cacheHits': responseCache.hits if responseCache != None else 0,
+        'cacheMisses': responseCache.misses if responseCache != None else 0,
+    }
+
+# returns the cache key for a request, or None if the request shouldn't be cached
+def getCacheKey(cache: bool, *parts):
+    if not cache or responseCache == None:
+        return None
+    return responseCache.getKey(*parts)
+
+# `endpoint` names the query in profiler output. only queries for a single
+# report pass `cache`, since a report never changes once uploaded; anything
+# else (e.g. the zone's report list) has to be asked for again every time.
+# returns None if the request fails, or with `raiseErrors` raises FetchError
+def fetchGraphQL(query, cache: bool = False, endpoint: str = 'graphql', raiseErrors: bool = False):
+    cacheKey = getCacheKey(cache, apiUrl, query)
+    if cacheKey != None:
+        response = responseCache.get(cacheKey)
+        if response != None:
             return response
+
+    try:
+        response = client.post(apiUrl, json={'query': query}, headers=headers, endpoint=endpoint)
+        with profiler.timer('json decode'):
+            response = response.json()
     except Exception as e:
-        print(e)
-        print('Sleeping', datetime.now())
-        time.sleep(60)
-        fetchGraphQL(query)
-
-def fetchAbilityEvents(reportCode: str, encounterID: int, targetID: int, abilityID: int, abilityTypes: list = []):
-    typeString = ''
-    abilityCount = len(abilityTypes)
-    if abilityCount > 0:
-        typeString = ' and type in ('
-        i = 1
-        for abilityType in abilityTypes:
-            typeString += '\\"' + abilityType + '\\"'
-            if i < abilityCount: 
-                typeString += ','
-            else:
-                typeString += ')'
-            i += 1
+        print('fetchGraphQL failed: ' + str(e), datetime.now())
+        if raiseErrors:
+            raise FetchError('fetchGraphQL failed: ' + str(e), transient=True)
+        return None
 
+    if response.get('errors'):
+        if raiseErrors:
+            raise FetchError('api error: ' + str(response.get('errors')[0].get('message')))
+        return None
+    if cacheKey != None:
+        responseCache.put(cacheKey, response)
+    return response
+
+# current usage of the v2 api's hourly points budget. this skips the budget
+# check itself, otherwise we'd never be able to find out it had reset
+def fetchRateLimitData() -> dict:
     query = '''
-    {{
-      reportData {{
-        report(code: "{reportCode}") {{
-          events(dataType: All, startTime: 0, endTime: 999999999999, encounterID: {encounterID}, filterExpression: "ability.id = {abilityID}{typeString}") {{
-            nextPageTimestamp
-            data
-          }}
-        }}
-      }}
-    }}
-    '''.format(reportCode=reportCode, encounterID=encounterID, abilityID=abilityID, typeString=typeString)
-    
-    return list(filter(lambda event: event.get('targetID') == targetID, [
-        match.value for match in 
-            parse('$.data.reportData.report.events.data[*]').find(fetchGraphQL(query))
-    ]))
-
-def fetchActors(reportCode: str) -> dict:
-    query = '''
+    {
+        rateLimitData {
+            limitPerHour
+            pointsSpentThisHour
+            pointsResetIn
+        }
+    }
+    '''
+    response = client.post(apiUrl, json={'query': query}, headers=headers, useBudget=False, endpoint='graphql rateLimitData').json()
+    return response.get('data', {}).get('rateLimitData', {})
+
+client.budget.refresh = fetchRateLimitData
+
+# the query for a single report. `fields` is what to select on the report
+def getReportQuery(reportCode: str, fields: str) -> str:
+    return '''
     {{
         reportData {{
-            report(code: "{reportCode}") {{
-                masterData(translate: false) {{
-                    actors {{
-                        id
-                        name
-                        type
-                        subType
-                        icon
-                        gameID
-                    }}
-                }}
+            report(code: "{reportCode}") {{{fields}
             }}
         }}
     }}
-    '''.format(reportCode=reportCode)
-    #print('query: ' + query)
-    return fetchGraphQL(query)
+    '''.format(reportCode=reportCode, fields=fields)
+
+# Fetch many reports in one request by giving each `report` field an alias
+# (r0: report(...), r1: report(...), ...). `reportRequests` is a list of
+# (reportCode, fields) and the result is a list of reports (or None) in the same
+# order. The same report can be requested more than once with different fields.
+#
+# Chunks start at REPORT_BATCH_SIZE. When the api fails a whole chunk with an
+# error (too complex, timed out) it's split in half and retried, and later chunks
+# start smaller, growing back one report at a time while requests succeed. A
+# request that fails in transport (the client has already retried it) fails
+# every report of the chunk as it is, since smaller requests wouldn't help. The chunk size is
+# shared by every thread batching at the same time, guarded by a lock.
+#
+# A response can carry errors next to partial data. An error under one report
+# (its path starts with the report's alias) fails just that report, which is
+# retried on its own; any other error fails the whole chunk. A report with an
+# error is never returned, so half a report can't end up in the response cache.
+REPORT_BATCH_SIZE = 25
+reportBatchSize = REPORT_BATCH_SIZE
+reportBatchSizeLock = threading.Lock()
 
-def fetchPlayers(reportCode: str) -> dict:
+def fetchReportsBatched(reportRequests: list) -> list:
+    reports = []
+    i = 0
+    while i < len(reportRequests):
+        with reportBatchSizeLock:
+            chunk = reportRequests[i:i + reportBatchSize]
+        reports += fetchReportBatch(chunk)
+        i += len(chunk)
+    return reports
+
+def fetchReportBatch(reportRequests: list) -> list:
+    global reportBatchSize
+    aliases = ''.join('''
+            r{i}: report(code: "{reportCode}") {{{fields}
+            }}'''.format(i=i, reportCode=reportCode, fields=fields) for i, (reportCode, fields) in enumerate(reportRequests))
     query = '''
     {{
-        reportData {{
-            report(code: "{reportCode}") {{
-                masterData(translate: false) {{
-                    actors(type: "Player") {{
+        reportData {{{aliases}
+        }}
+    }}
+    '''.format(aliases=aliases)
+
+    try:
+        response = client.post(apiUrl, json={'query': query}, headers=headers, endpoint='graphql report batch')
+        with profiler.timer('json decode'):
+            response = response.json()
+    except Exception as e:
+        print('fetchReportBatch failed: ' + str(e), datetime.now())
+        return [None] * len(reportRequests)
+    reportData = (response.get('data') or {}).get('reportData')
+    failed = set()
+    for error in response.get('errors') or []:
+        path = error.get('path') or []
+        if len(path) >= 2 and path[0] == 'reportData' and str(path[1]).startswith('r'):
+            failed.add(path[1])
+        else:
+            reportData = None
+
+    if reportData == None:
+        if len(reportRequests) == 1:
+            return [None]
+        half = len(reportRequests) // 2
+        with reportBatchSizeLock:
+            reportBatchSize = max(half, 1)
+        return fetchReportBatch(reportRequests[:half]) + fetchReportBatch(reportRequests[half:])
+
+    if len(reportRequests) == 1:
+        return [None if failed else reportData.get('r0')]
+    with reportBatchSizeLock:
+        reportBatchSize = min(reportBatchSize + 1, REPORT_BATCH_SIZE)
+    return [fetchReportBatch([reportRequest])[0] if 'r' + str(i) in failed else reportData.get('r' + str(i))
+            for i, reportRequest in enumerate(reportRequests)]
+
+# A report query can select several parts (masterData, aliased events fields).
+# Each part is cached on its own, under the key of a query for just that part,
+# so a query for another mix of parts (other schools, fewer pending specs) only
+# has to fetch the parts that aren't cached yet. `parts` is a list of
+# (name, fields), name being the field's (alias) name in the report.
+def getReportPartKey(reportCode: str, fields: str):
+    return getCacheKey(True, apiUrl, getReportQuery(reportCode, fields))
+
+# parts the api returned null for aren't cached, so they're asked for again next time
+def putReportParts(reportCode: str, parts: list, report: dict):
+    for name, fields in parts:
+        if report.get(name) == None:
+            continue
+        responseCache.put(getReportPartKey(reportCode, fields), {'data': {'reportData': {'report': {name: report.get(name)}}}})
+
+# fetch the `parts` of a report, each replayed from the response cache when it's
+# there. returns the report with every part, raises FetchError if it couldn't be
+# loaded
+def fetchReportParts(reportCode: str, parts: list, endpoint: str = 'graphql report'):
+    report = {}
+    missing = []
+    for name, fields in parts:
+        cacheKey = getReportPartKey(reportCode, fields)
+        response = responseCache.get(cacheKey) if cacheKey != None else None
+        if response != None:
+            report.update(response.get('data').get('reportData').get('report'))
+        else:
+            missing.append((name, fields))
+    if len(missing) == 0:
+        return report
+
+    response = fetchGraphQL(getReportQuery(reportCode, ''.join(fields for name, fields in missing)), endpoint=endpoint, raiseErrors=True)
+    fetched = ((response.get('data') or {}).get('reportData') or {}).get('report')
+    if fetched == None:
+        raise FetchError('report ' + reportCode + ' not found')
+    if responseCache != None:
+        putReportParts(reportCode, missing, fetched)
+    report.update(fetched)
+    return report
+
+# Batch fetch the `parts` of many reports into the response cache, so later
+# fetchReportParts calls replay them from disk. `reportRequests` is a list of
+# (reportCode, parts). Parts that are already cached are skipped. Does nothing
+# without a cache.
+def prefetchReports(reportRequests: list):
+    if responseCache == None:
+        return
+
+    missing = []
+    for reportCode, parts in reportRequests:
+        parts = [(name, fields) for name, fields in parts if not responseCache.contains(getReportPartKey(reportCode, fields))]
+        if len(parts) > 0:
+            missing.append((reportCode, parts))
+
+    reports = fetchReportsBatched([(reportCode, ''.join(fields for name, fields in parts)) for reportCode, parts in missing])
+    for (reportCode, parts), report in zip(missing, reports):
+        if report != None:
+            putReportParts(reportCode, parts, report)
+
+# Walks every page of a report's events. WCL only returns so many events per
+# request (at most EVENTS_PAGE_LIMIT) and sets `nextPageTimestamp` when there's
+# more, so keep asking from there until it's null. Events are yielded as each
+# page arrives, and a page that can't be fetched raises FetchError rather than
+# ending the walk early, since the events so far would look like all of them. `hostilityType` ('Enemies' or 'Friendlies') and `abilityID`
+# narrow buff and debuff events down to one aura. With an `alias` the field can
+# be one of several in the same report query.
+EVENTS_PAGE_LIMIT = 10000
+
+def getEventsFields(encounterID: int, dataType: str, startTime: int, filterExpression: str = '',
+                    hostilityType: str = None, abilityID: int = None, alias: str = None) -> str:
+    filterString = ''
+    if hostilityType:
+        filterString += ',\n                        hostilityType: {}'.format(hostilityType)
+    if abilityID != None:
+        filterString += ',\n                        abilityID: {}'.format(abilityID)
+    if filterExpression:
+        filterString += ', filterExpression: "{}"'.format(filterExpression)
+
+    return '''
+                    {alias}events(
+                        dataType: {dataType},
+                        startTime: {startTime},
+                        endTime: 999999999999,
+                        limit: {limit},
+                        encounterID: {encounterID}{filterString}
+                    ) {{
+                        nextPageTimestamp
+                        data
+                    }}'''.format(alias=alias + ': ' if alias else '', dataType=dataType, startTime=startTime, limit=EVENTS_PAGE_LIMIT,
+                                 encounterID=encounterID, filterString=filterString)
+
+def fetchEvents(reportCode: str, encounterID: int, dataType: str = 'All', filterExpression: str = '',
+                hostilityType: str = None, abilityID: int = None, startTime: int = 0):
+    while startTime != None:
+        query = getReportQuery(reportCode, getEventsFields(encounterID, dataType, startTime, filterExpression, hostilityType, abilityID))
+        response = fetchGraphQL(query, cache=True, endpoint='graphql events ' + dataType, raiseErrors=True)
+        events = ((response.get('data') or {}).get('reportData') or {}).get('report') or {}
+        events = events.get('events')
+        if events == None:
+            raise FetchError('events page failed - reportCode: ' + reportCode + ', encounterID: ' + str(encounterID) +
+                             ', dataType: ' + dataType + ', startTime: ' + str(startTime))
+
+        yield from events.get('data') or []
+
+        nextPageTimestamp = events.get('nextPageTimestamp')
+        if nextPageTimestamp != None and nextPageTimestamp <= startTime:
+            raise FetchError('events page did not advance - reportCode: ' + reportCode + ', encounterID: ' + str(encounterID) +
+                             ', dataType: ' + dataType + ', startTime: ' + str(startTime))
+        startTime = nextPageTimestamp
+
+# Everything needed to score a report for an encounter in one request: the
+# masterData actors plus one aliased events field per entry of `eventRequests`,
+# a list of (alias, dataType, filterExpression, hostilityType, abilityID). Each
+# field is cached on its own (see fetchReportParts). Returns [actors, {alias:
+# events}], and raises FetchError if the report couldn't be loaded completely.
+# Fields with more events than fit in a page are followed up one by one. A
+# report missing any page fails rather than being partly loaded: a curse or aura
+# timeline cut short would put later casts in the wrong curse mode, which biases
+# the hit tables.
+def getReportLoadParts(encounterID: int, eventRequests: list) -> list:
+    return [('masterData', actorsFields)] + \
+           [(alias, getEventsFields(encounterID, dataType, 0, filterExpression, hostilityType, abilityID, alias))
+            for alias, dataType, filterExpression, hostilityType, abilityID in eventRequests]
+
+def fetchReportLoad(reportCode: str, encounterID: int, eventRequests: list):
+    report = fetchReportParts(reportCode, getReportLoadParts(encounterID, eventRequests))
+    if report.get('masterData') == None:
+        raise FetchError('report ' + reportCode + ' has no masterData')
+    actors = report.get('masterData').get('actors') or []
+    events = {}
+    for alias, dataType, filterExpression, hostilityType, abilityID in eventRequests:
+        page = report.get(alias)
+        if page == None:
+            raise FetchError('report ' + reportCode + ' has no ' + alias + ' events')
+        events[alias] = list(page.get('data') or [])
+        nextPageTimestamp = page.get('nextPageTimestamp')
+        if nextPageTimestamp != None:
+            events[alias] += list(fetchEvents(reportCode, encounterID, dataType, filterExpression, hostilityType, abilityID, nextPageTimestamp))
+    return [actors, events]
+
+# a report's masterData actors, replayed from the response cache when they're
+# there. raises FetchError if the report couldn't be loaded
+def fetchReportActors(reportCode: str):
+    report = fetchReportParts(reportCode, [('masterData', actorsFields)], endpoint='graphql masterData')
+    if report.get('masterData') == None:
+        raise FetchError('report ' + reportCode + ' has no masterData')
+    return report.get('masterData').get('actors') or []
+
+# fetchReportLoad for many reports, batched into the response cache in two
+# requests: the actors of every report, then their events. `reportLoads` is a
+# list of (reportCode, encounterID, getEventRequests), getEventRequests(actors)
+# returning the eventRequests for a report with those actors, so the events can
+# be filtered on actor ids. Reports whose actors couldn't be loaded are left for
+# fetchReportActors to retry. Does nothing without a cache.
+def prefetchReportLoads(reportLoads: list):
+    if responseCache == None:
+        return
+
+    prefetchReports([(reportCode, [('masterData', actorsFields)]) for reportCode, encounterID, getEventRequests in reportLoads])
+    reportRequests = []
+    for reportCode, encounterID, getEventRequests in reportLoads:
+        if not responseCache.contains(getReportPartKey(reportCode, actorsFields)):
+            continue
+        reportRequests.append((reportCode, getReportLoadParts(encounterID, getEventRequests(fetchReportActors(reportCode)))))
+    prefetchReports(reportRequests)
+
+actorsFields = '''
+                masterData(translate: false) {
+                    actors {
                         id
                         name
                         type
                         subType
                         icon
                         gameID
-                    }}
-                }}
-            }}
-        }}
-    }}
-    '''.format(reportCode=reportCode)
-    #print('query: ' + query)
-    return fetchGraphQL(query)
+                    }
+                }'''
 
-def fetchReportSummary(reportCode: str):
-    query = '''
-    {{
-        reportData {{
-            report(code: "{reportCode}") {{
-                masterData(translate: false) {{
-                    actors(type: "Player") {{
+reportSummaryFields = '''
+                masterData(translate: false) {
+                    actors(type: "Player") {
                         icon
-                    }},
-                    abilities {{
+                    },
+                    abilities {
                         gameID
                         type
-                    }}
-                }}
-            }}
-        }}
-    }}
-    '''.format(reportCode=reportCode)
-    response = fetchGraphQL(query)
+                    }
+                }'''
+
+# the summary of each report in `reportCodes`, or None for a report that couldn't
+# be loaded (it isn't summarized as empty, so a later build can try it again)
+def fetchReportSummaries(reportCodes: list) -> list:
+    reports = fetchReportsBatched([(reportCode, reportSummaryFields) for reportCode in reportCodes])
+    return [getReportSummary(reportCode, report) if report != None else None for reportCode, report in zip(reportCodes, reports)]
 
-    abilities = [
-        match.value for match in 
-          parse('$.data.reportData.report.masterData.abilities[*]').find(response)
-    ]
+# reduce a report's masterData to the spells cast and the specs present
+def getReportSummary(reportCode: str, report: dict):
+    with profiler.timer('jsonpath'):
+        abilities = [
+            match.value for match in 
+              parse('$.masterData.abilities[*]').find(report or {})
+        ]
 
-    actors = [
-        match.value for match in 
-          parse('$.data.reportData.report.masterData.actors[*]').find(response)
-    ]
+        actors = [
+            match.value for match in 
+              parse('$.masterData.actors[*]').find(report or {})
+        ]
 
     # filter out stuff like melee and add to spells list
     spellIDsSet = set()
@@ -151,77 +403,17 @@ def fetchReportSummary(reportCode: str):
         'icons': list(iconSet)    
     }    
 
-def fetchSpellIDs(reportCode: str) -> dict:
-    # fetch abilities
-    query = '''
-    {{
-        reportData {{
-            report(code: "{reportCode}") {{
-                masterData(translate: false) {{
-                    abilities {{
-                        gameID
-                        name
-                        type
-                    }}
-                }}
-            }}
-        }}
-    }}
-    '''.format(reportCode=reportCode)
-    abilities = [
-        match.value for match in 
-          parse('$.data.reportData.report.masterData.abilities[*]').find(fetchGraphQL(query))
-    ]
-
-    # filter out stuff like melee and add to spells list
-    spellIDs = []
-    for ability in abilities:
-        if int(ability.get('type')) > 2: 
-            spellIDs.append(ability.get('gameID'))
-    return spellIDs
-
-def fetchGear(url: str, encounterID: int) -> dict:
-    query = '''
-    {{
-        reportData {{
-            report(code: "{reportUrl}")  {{
-                events(
-                    dataType: CombatantInfo, 
-                    endTime: 99999999999, 
-                    startTime: 0,
-                    encounterID: {encounterID}
-                ) {{
-                    data
-                    nextPageTimestamp
-                }}
-            }}
-        }}
-    }}
-    '''.format(reportUrl=url, encounterID=encounterID)
-    return fetchGraphQL(query)
+# events from players of a spec (by name, e.g. 'Fire')
+def getSpecFilter(spec: str) -> str:
+    return "source.spec='{spec}'".format(spec=spec)
 
+# a filterExpression matching only events from or to the given actor ids, e.g.
+# getActorFilter('target', [12]) -> 'target.id in (12)'
+def getActorFilter(actor: str, actorIDs: list) -> str:
+    return '{}.id in ({})'.format(actor, ', '.join(str(actorID) for actorID in actorIDs))
 
-def fetchDamageEvents(reportCode: str, encounterID, spec: str, abilityQuery: str) -> dict:
-    query = '''
-    {{
-        reportData {{
-            report(code: "{reportCode}") {{
-                events(
-                    dataType: DamageDone,
-                    startTime: 0,
-                    endTime: 999999999999,
-                    encounterID: {encounterID},
-                    filterExpression: "source.spec='{spec}' and {abilityQuery}"
-                ) {{
-                    nextPageTimestamp
-                    data
-                }}
-            }}
-        }}
-    }}
-    '''.format(reportCode=reportCode, encounterID=encounterID, spec=spec, abilityQuery=abilityQuery)
-    #print(query)
-    return fetchGraphQL(query)
+def getDamageEventsFilter(spec: str, abilityQuery: str) -> str:
+    return "{specFilter} and {abilityQuery}".format(specFilter=getSpecFilter(spec), abilityQuery=abilityQuery)
 
 
 def fetchReportList(zone: int, page: int, limit: int = 100) -> dict:
@@ -237,7 +429,8 @@ def fetchReportList(zone: int, page: int, limit: int = 100) -> dict:
         }
       }
     }"""
-    return fetchGraphQL(query)
+    # never cached, a refresh (-u) has to see reports uploaded since the last one
+    return fetchGraphQL(query, cache=False, endpoint='graphql reports')
 
 
 enchantData = {